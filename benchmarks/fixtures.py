@@ -0,0 +1,155 @@
+"""
+Synthetic fixtures for the benchmarks: a fake home directory with a Steam install, a Cemu install with BOTW dumps,
+a fake mod release, and a stub of BCML.
+"""
+
+import json
+import os
+import sys
+import types
+import zipfile
+from typing import Dict
+from xml.etree import ElementTree as ET
+
+import vdf
+
+SCALES: Dict[str, Dict[str, int]] = {
+    # users: Steam users; shortcuts: existing shortcuts per user; friends: friends per localconfig.vdf;
+    # compat: CompatToolMapping entries in config.vdf; titles: entries in title_list_cache.xml;
+    # files: files in the mod release and the generated graphics pack; clutter: extra files in the home directory
+    "small": {"users": 1, "shortcuts": 10, "friends": 10, "compat": 10, "titles": 10, "files": 100, "clutter": 1000},
+    "medium": {"users": 4, "shortcuts": 200, "friends": 500, "compat": 200, "titles": 200, "files": 1000,
+               "clutter": 10000},
+    "large": {"users": 16, "shortcuts": 2000, "friends": 5000, "compat": 2000, "titles": 2000, "files": 5000,
+              "clutter": 50000},
+}
+
+FILE_SIZE = 4096
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dump_manifests")
+
+
+def make_steam(home: str, users: int, shortcuts: int, friends: int, compat: int, **_):
+    steam_dir = os.path.join(home, ".steam", "steam")
+    os.makedirs(os.path.join(steam_dir, "steamapps"), exist_ok=True)
+    os.makedirs(os.path.join(steam_dir, "config"), exist_ok=True)
+
+    mapping = {str(3000000000 + i): {"name": "proton_experimental", "config": "", "priority": "250"}
+               for i in range(compat)}
+    with open(os.path.join(steam_dir, "config", "config.vdf"), "w") as config_file:
+        vdf.dump({"InstallConfigStore": {"Software": {"Valve": {"Steam": {"CompatToolMapping": mapping}}}}},
+                 config_file)
+
+    for user in range(users):
+        config_dir = os.path.join(steam_dir, "userdata", str(10000000 + user), "config")
+        os.makedirs(config_dir, exist_ok=True)
+        friends_dict = {str(20000000 + i): {"name": f"Friend {i}", "avatar": "0" * 40} for i in range(friends)}
+        friends_dict["PersonalName"] = f"User {user}"
+        with open(os.path.join(config_dir, "localconfig.vdf"), "w", encoding="utf-8") as localconfig_file:
+            vdf.dump({"UserLocalConfigStore": {"friends": friends_dict}}, localconfig_file)
+        entries = {str(i): {"appid": -(i + 1), "appname": f"Game {i}", "Exe": f"\"/games/{i}.exe\"",
+                            "StartDir": "\"/games\"", "icon": "", "LaunchOptions": "", "tags": {}}
+                   for i in range(shortcuts)}
+        with open(os.path.join(config_dir, "shortcuts.vdf"), "wb") as shortcuts_file:
+            vdf.binary_dump({"shortcuts": entries}, shortcuts_file)
+
+
+def make_cemu(home: str, titles: int, **_) -> str:
+    cemu_dir = os.path.join(home, "Emulation", "roms", "wiiu")
+    os.makedirs(os.path.join(cemu_dir, "graphicPacks"), exist_ok=True)
+    open(os.path.join(cemu_dir, "Cemu.exe"), "wb").close()
+
+    settings = ET.Element("content")
+    ET.SubElement(settings, "GraphicPack")
+    ET.ElementTree(settings).write(os.path.join(cemu_dir, "settings.xml"))
+
+    dumps = {
+        "00050000101c9400": ("game", "content", "Layout", "Horse.sblarc"),
+        "0005000e101c9400": ("update", "content", "Actor/Pack", "ActorObserverByActorTagTag.sbactorpack"),
+        "0005000c101c9400": ("dlc", "content/0010", "Movie", "Demo655_0.mp4"),
+    }
+    title_list = ET.Element("title_list")
+    for i in range(titles):
+        title = ET.SubElement(title_list, "title", {"titleId": f"00050000{i:08x}"})
+        ET.SubElement(title, "path").text = f"Z:\\games\\{i}"
+    for title_id, (name, base_dir, sub_folder, marker) in dumps.items():
+        dump_dir = os.path.join(home, "dumps", name)
+        os.makedirs(os.path.join(dump_dir, base_dir, sub_folder), exist_ok=True)
+        open(os.path.join(dump_dir, base_dir, sub_folder, marker), "wb").close()
+        # plus the files the shipped reference manifest requires, so the dumps validate
+        with open(os.path.join(REFERENCE_DIR, f"{title_id}.json"), "r") as reference_file:
+            for rel_path in json.load(reference_file)["files"]:
+                os.makedirs(os.path.dirname(os.path.join(dump_dir, base_dir, rel_path)), exist_ok=True)
+                open(os.path.join(dump_dir, base_dir, rel_path), "wb").close()
+        title = ET.SubElement(title_list, "title", {"titleId": title_id})
+        ET.SubElement(title, "path").text = dump_dir
+    ET.ElementTree(title_list).write(os.path.join(cemu_dir, "title_list_cache.xml"))
+    return cemu_dir
+
+
+def make_files(directory: str, files: int):
+    for i in range(files):
+        sub_dir = os.path.join(directory, f"dir{i % 20}")
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, f"file{i}.bin"), "wb") as f:
+            f.write(os.urandom(FILE_SIZE))
+
+
+def make_release(mirror_dir: str, files: int, **_):
+    """
+    Create a mirror directory (see utils.mirror) with a fake mod release zip.
+    """
+    os.makedirs(os.path.join(mirror_dir, "assets"), exist_ok=True)
+    with zipfile.ZipFile(os.path.join(mirror_dir, "assets", "BOTW.Release.zip"), "w") as zip_file:
+        for i in range(files):
+            zip_file.writestr(f"dir{i % 20}/file{i}.bin", os.urandom(FILE_SIZE))
+    release = [{"tag_name": "1.0.0", "assets": [
+        {"browser_download_url": "https://github.com/example/releases/download/1.0.0/BOTW.Release.zip"}]}]
+    with open(os.path.join(mirror_dir, "releases.json"), "w") as releases_file:
+        json.dump(release, releases_file)
+
+
+def make_graphics_pack(directory: str, files: int, **_):
+    make_files(directory, files)
+    make_files(os.path.join(directory, "patches"), max(1, files // 10))
+    open(os.path.join(directory, "rules.txt"), "w").close()
+    open(os.path.join(directory, "patches", "rules.txt"), "w").close()
+
+
+def make_clutter(home: str, clutter: int, **_):
+    """
+    Create empty files for scan_for_cemu to walk through.
+    """
+    for i in range(clutter):
+        sub_dir = os.path.join(home, "clutter", f"dir{i // 100}")
+        os.makedirs(sub_dir, exist_ok=True)
+        open(os.path.join(sub_dir, f"file{i}"), "wb").close()
+
+
+def make_fixtures(home: str, scale: Dict[str, int]):
+    make_steam(home, **scale)
+    make_cemu(home, **scale)
+    make_release(os.path.join(home, "mirror"), **scale)
+    make_graphics_pack(os.path.join(home, "graphics_pack"), **scale)
+    make_clutter(home, **scale)
+
+
+def install_bcml_stub(pack_files: int):
+    """
+    Replace bcml.install with a stub whose export writes a small fake graphics pack, so the installer's own overhead
+    around the merge can be measured without BCML or a game dump.
+    """
+    def export(output, standalone=False):
+        import py7zr
+        with py7zr.SevenZipFile(output, "w") as archive:
+            for i in range(pack_files):
+                archive.writestr(os.urandom(FILE_SIZE), f"content/file{i}.bin")
+            archive.writestr(b"", "patches/rules.txt")
+
+    bcml = types.ModuleType("bcml")
+    bcml_install = types.ModuleType("bcml.install")
+    bcml_install.install_mod = lambda *args, **kwargs: None
+    bcml_install.refresh_merges = lambda *args, **kwargs: None
+    bcml_install.export = export
+    bcml.install = bcml_install
+    sys.modules["bcml"] = bcml
+    sys.modules["bcml.install"] = bcml_install
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+"""
+Benchmarks for the installer's hot paths, run against synthetic fixtures (see fixtures.py) so no Steam Deck, game dump
+or network access is needed: a fake home directory with a Steam install and a Cemu install, a release served over
+localhost by the mirror server, and a stub in place of BCML.
+
+Each scale runs in its own process with HOME pointing at that scale's fixtures (the installer's paths are resolved at
+import time). The median of the repeats is compared against the stored baseline, and the run fails if any benchmark
+got slower than the allowed ratio.
+
+Usage (from the repository root): python benchmarks/hot_paths.py [--scales small medium] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+
+def time_benchmark(func: Callable, repeat: int, setup: Optional[Callable] = None,
+                   teardown: Optional[Callable] = None) -> float:
+    """
+    Time func, returning the median over repeat runs. setup and teardown run around every call, untimed.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown()
+    return statistics.median(times)
+
+
+def run_scale(scale_name: str, home: str, repeat: int) -> Dict[str, float]:
+    """
+    Run the benchmarks for one scale. Must run in a process whose HOME is already set to the fixtures' home directory,
+    before anything from utils is imported.
+    """
+    from fixtures import SCALES, install_bcml_stub
+
+    scale = SCALES[scale_name]
+    sys.path.insert(0, REPO_DIR)
+    install_bcml_stub(scale["files"])
+
+    from utils import answers, common, steam
+    from utils.cemu import get_user_paths, scan_for_cemu
+    from utils.common import MOD_DIR, STEAM_DIR, WORKING_DIR
+    from utils.mirror import create_mirror_server
+    from utils.multiplayer_mod import download_mod_files, generate_graphics_packs, place_graphics_packs
+
+    answers.set_answers({"scan_for_cemu": True}, unattended=True)
+    # closing Steam is an external side effect with nothing to measure
+    steam.terminate_program = lambda *args, **kwargs: None
+    os.makedirs(WORKING_DIR, exist_ok=True)
+
+    server = create_mirror_server(os.path.join(home, "mirror"), "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    common.set_mirror_url(f"http://127.0.0.1:{server.server_address[1]}")
+
+    user_ids = sorted(os.listdir(os.path.join(STEAM_DIR, "userdata")))
+    shortcuts_paths = [os.path.join(STEAM_DIR, f"userdata/{user_id}/config/shortcuts.vdf") for user_id in user_ids]
+    config_vdf_path = os.path.join(STEAM_DIR, "config", "config.vdf")
+    originals = {path: open(path, "rb").read() for path in shortcuts_paths + [config_vdf_path]}
+
+    def restore_steam():
+        # start from the pristine files every time, so the shortcut is always added rather than found
+        for path, data in originals.items():
+            with open(path, "wb") as f:
+                f.write(data)
+        for user_id in user_ids:
+            config_dir = os.path.join(STEAM_DIR, f"userdata/{user_id}/config")
+            for file in os.listdir(config_dir):
+                if file.endswith(".bak"):
+                    os.remove(os.path.join(config_dir, file))
+        for file in os.listdir(os.path.dirname(config_vdf_path)):
+            if file.endswith(".bak"):
+                os.remove(os.path.join(os.path.dirname(config_vdf_path), file))
+
+    cemu_exe = os.path.join(home, "Emulation", "roms", "wiiu", "Cemu.exe")
+    cemu_dir = os.path.dirname(cemu_exe)
+
+    def hide_cemu():
+        # the scan only runs when Cemu wasn't detected, so measure the full walk of a home without Cemu.exe
+        os.rename(cemu_exe, cemu_exe + ".hidden")
+
+    def unhide_cemu():
+        os.rename(cemu_exe + ".hidden", cemu_exe)
+
+    def remove_mod():
+        shutil.rmtree(MOD_DIR, ignore_errors=True)
+
+    prefix_app_ids = list(range(3100000000, 3100000000 + len(user_ids)))
+    benchmarks = [
+        ("generate_steam_shortcut", lambda: steam.generate_steam_shortcut(user_ids), restore_steam, None),
+        ("set_proton_version", lambda: steam.set_proton_version(prefix_app_ids), restore_steam, None),
+        ("get_user_paths", get_user_paths, None, None),
+        ("scan_for_cemu", scan_for_cemu, hide_cemu, unhide_cemu),
+        ("download_mod_files", download_mod_files, remove_mod, None),
+        ("generate_graphics_packs",
+         lambda: generate_graphics_packs(*[os.path.join(home, "dumps", name) for name in ["game", "update", "dlc"]]),
+         None, None),
+        ("place_graphics_packs", lambda: place_graphics_packs(cemu_dir, os.path.join(home, "graphics_pack")),
+         None, None),
+    ]
+
+    results = {}
+    real_stdout = sys.stdout
+    for name, func, setup, teardown in benchmarks:
+        sys.stdout = open(os.devnull, "w")  # keep the installer's progress messages out of the results
+        try:
+            results[name] = time_benchmark(func, repeat, setup, teardown)
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+    server.shutdown()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            max_ratio: float, min_delta: float) -> List[str]:
+    """
+    Print the results next to the baseline.
+    :return: list of benchmarks that got slower than max_ratio times the baseline, and by more than min_delta seconds
+    """
+    regressions = []
+    print(f"{'scale':<8}{'benchmark':<26}{'median ms':>11}{'baseline ms':>13}{'ratio':>8}")
+    for scale_name, scale_results in results.items():
+        for name, seconds in scale_results.items():
+            base = baseline.get(scale_name, {}).get(name)
+            if base is None:
+                print(f"{scale_name:<8}{name:<26}{seconds * 1000:11.1f}{'-':>13}{'-':>8}")
+                continue
+            ratio = seconds / base if base > 0 else float("inf")
+            flag = ""
+            if ratio > max_ratio and seconds - base > min_delta:
+                regressions.append(f"{scale_name}/{name}")
+                flag = "  SLOWER"
+            print(f"{scale_name:<8}{name:<26}{seconds * 1000:11.1f}{base * 1000:13.1f}{ratio:8.2f}{flag}")
+    return regressions
+
+
+def main():
+    from fixtures import SCALES, make_fixtures
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES),
+                        help="scales to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (default: 5)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help=f"baseline file (default: {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--max-ratio", type=float, default=1.25,
+                        help="fail if a benchmark is slower than this times its baseline (default: 1.25)")
+    parser.add_argument("--min-delta-ms", type=float, default=5,
+                        help="ignore slowdowns smaller than this, which are mostly noise (default: 5)")
+    parser.add_argument("--keep-fixtures", action="store_true", help="don't delete the generated fixtures")
+    parser.add_argument("--run-scale", nargs=2, metavar=("SCALE", "HOME"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        scale_name, home = args.run_scale
+        print(json.dumps(run_scale(scale_name, home, args.repeat)))
+        return
+
+    results = {}
+    for scale_name in args.scales:
+        home = tempfile.mkdtemp(prefix=f"botwm-bench-{scale_name}-")
+        try:
+            print(f"Generating {scale_name} fixtures in {home}...", file=sys.stderr)
+            make_fixtures(home, SCALES[scale_name])
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scale", scale_name, home,
+                                     "--repeat", str(args.repeat)], env=dict(os.environ, HOME=home),
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                print(result.stderr, file=sys.stderr)
+                print(f"Benchmarks for scale '{scale_name}' failed with exit code {result.returncode}",
+                      file=sys.stderr)
+                exit(1)
+            results[scale_name] = json.loads(result.stdout.splitlines()[-1])
+        finally:
+            if not args.keep_fixtures:
+                shutil.rmtree(home, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.max_ratio, args.min_delta_ms / 1000)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"FAIL: slower than {args.max_ratio}x the baseline: {', '.join(regressions)}", file=sys.stderr)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
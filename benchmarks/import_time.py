@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""
+Import-time benchmark for the installer's startup path.
+
+Runs `python -X importtime main.py status` and fails if the installer's own imports take longer than the budget, or if
+any of the heavy dependencies that should only be imported by the stages that use them are imported at startup.
+
+Usage (from the repository root): python benchmarks/import_time.py [--budget-ms 50]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must not be imported just to start the installer
+HEAVY_MODULES = ["bcml", "py7zr", "requests", "http.server", "concurrent.futures", "crc32c"]
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    """
+    Parse the output of -X importtime.
+    :return: list of (self_us, cumulative_us, module) tuples; module keeps its leading spaces (nesting depth)
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((int(self_us), int(cumulative_us), module.rstrip()[1:]))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=50,
+                        help="maximum total time for the installer's own imports (default: 50)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py", "status"], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        print(f"`main.py status` failed with exit code {result.returncode}", file=sys.stderr)
+        exit(1)
+
+    imports = parse_importtime(result.stderr)
+    # everything imported at the top level after `site` is the installer's doing (interpreter startup isn't)
+    site_index = max((i for i, (_, _, module) in enumerate(imports) if module == "site"), default=-1)
+    own_imports = [(cumulative, module) for _, cumulative, module in imports[site_index + 1:]
+                   if not module.startswith(" ")]
+    own_ms = sum(cumulative for cumulative, _ in own_imports) / 1000
+    heavy = sorted({module.strip() for _, _, module in imports
+                    if any(module.strip() == m or module.strip().startswith(m + ".") for m in HEAVY_MODULES)})
+
+    print(f"`main.py status` wall time: {wall_ms:.1f} ms (including interpreter startup)")
+    print(f"Installer imports: {own_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for cumulative, module in sorted(own_imports, reverse=True)[:10]:
+        print(f"  {cumulative / 1000:7.1f} ms  {module}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}", file=sys.stderr)
+        failed = True
+    if own_ms > args.budget_ms:
+        print(f"FAIL: installer imports took {own_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+        failed = True
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
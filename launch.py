@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Launch wrapper for the Breath of the Wild Multiplayer mod. The mod's Steam shortcut runs the copy of this that the
+installer puts in its working directory (see utils.launcher) with Steam's %command%; it checks the install (repairing
+small drift) and then runs the command. Kept separate from main.py so that it only imports what it needs.
+"""
+
+import sys
+
+from utils.launcher import launch
+
+if __name__ == "__main__":
+    launch(sys.argv[1:])
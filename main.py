@@ -1,48 +1,557 @@
 #!/usr/bin/python
 
+import argparse
+import json
 import os
 import sys
+from typing import Any, Dict, List
 
-from utils.cemu import get_user_paths
-from utils.common import STEAM_DIR, WORKING_DIR
-from utils.multiplayer_mod import download_mod_files, generate_graphics_packs, \
-    place_graphics_packs, \
-    update_graphics_packs, update_user_config
-from utils.steam import add_dependencies_to_prefix, add_grids, generate_steam_shortcut, is_valid_steam_installation
+from utils.answers import ANSWER_KEYS, get_answer, load_answer_file, set_answers
+from utils.common import EXIT_INVALID_ANSWER, EXIT_MANUAL_STEP_REQUIRED, EXIT_PLAN_HAS_CHANGES, MOD_DIR, STATE_PATH, \
+    STEAM_DIR, WORKING_DIR, ManualStepRequired, set_mirror_url, wait_for_confirmation, wait_for_enter
+from utils.dumps import DLC_TITLE_ID, GAME_TITLE_ID, UPDATE_TITLE_ID
+from utils.priority import lower_priority, run_in_cgroup, set_copy_rate
+from utils.stages import Stage, get_dependents, load_state, run_stages
+from utils.winetricks_cache import DOTNET_VERB, add_to_cache
 
+STAGE_NAMES = ["download", "shortcut", "grids", "prefix", "dumps", "generate", "place", "settings", "config"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Installer for the Breath of the Wild Multiplayer mod.")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="rerun the given install stage (and the stages after it) even if it is up to date; "
+                             "can be given multiple times. Stages: " + ", ".join(STAGE_NAMES))
+    parser.add_argument("--deep-dump-check", action="store_true",
+                        help="also compare the game/update/DLC dumps' file hashes when validating them; only works "
+                             "with reference manifests that include hashes (made with dump-manifest --hashes), "
+                             "which the shipped ones don't")
+    parser.add_argument("--profile", action="store_true",
+                        help="save a cProfile profile of each install stage next to the run log (the stages then run "
+                             "one at a time)")
+    parser.add_argument("--mirror", metavar="URL", help="download the mod and Cemu from a LAN mirror (see "
+                                                        "mirror-serve) instead of the internet")
+
+    priority = parser.add_argument_group("background priority", "Keep the install from making Steam or a running "
+                                                                "game stutter, at the cost of a slower install.")
+    priority.add_argument("--background", action="store_true",
+                          help="run the installer (and the programs it starts, e.g. protontricks) at the lowest CPU "
+                               "priority and in the idle I/O class")
+    priority.add_argument("--cgroup-weight", type=int, metavar="WEIGHT",
+                          help="also run in a systemd scope with this cgroup v2 CPU and I/O weight (1-10000, the "
+                               "default for other programs is 100)")
+    priority.add_argument("--copy-rate", type=float, metavar="MB_PER_S",
+                          help="limit large copies (e.g. placing the graphics packs) to this many MB/s")
+
+    unattended = parser.add_argument_group("unattended mode", "Answer the installer's prompts from an answer file "
+                                                              "(JSON, or TOML on Python 3.11+) and/or these flags. "
+                                                              "Flags override the answer file.")
+    unattended.add_argument("--answers", metavar="FILE", help="answer file; implies --unattended")
+    unattended.add_argument("-y", "--unattended", action="store_true",
+                            help="never prompt: accept detected values, and exit with an error code if an answer "
+                                 "is missing or a manual step is needed")
+    unattended.add_argument("--steam-user", help="Steam user id or persona name to install for")
+    unattended.add_argument("--all-users", dest="steam_user", action="store_const", const="all",
+                            help="install the shortcut for every Steam user on this device")
+    unattended.add_argument("--cemu-dir", help="Cemu directory (where Cemu.exe is)")
+    unattended.add_argument("--game-dir", help="BOTW game dump directory (the /content folder)")
+    unattended.add_argument("--update-dir", help="BOTW update dump directory (the /content folder)")
+    unattended.add_argument("--dlc-dir", help="BOTW DLC dump directory (the /content/0010 folder)")
+    unattended.add_argument("--check-updates", dest="check_for_updates", action="store_const", const=True,
+                            help="check for mod updates if the mod is already downloaded (default)")
+    unattended.add_argument("--no-check-updates", dest="check_for_updates", action="store_const", const=False,
+                            help="don't check for mod updates if the mod is already downloaded")
+    unattended.add_argument("--scan-for-cemu", action="store_const", const=True,
+                            help="scan the home directory for Cemu if it isn't found")
+    unattended.add_argument("--download-cemu", action="store_const", const=True,
+                            help="download Cemu if it isn't found")
+    unattended.add_argument("--manual-steps", dest="manual_steps", action="store_const", const=True,
+                            help="if a step can't be done automatically, wait for it to be done by hand")
+    unattended.add_argument("--no-manual-steps", dest="manual_steps", action="store_const", const=False,
+                            help="if a step can't be done automatically, exit with instructions (default in "
+                                 "unattended mode)")
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    cache_parser = subparsers.add_parser("cache-add", help="Add local installer payloads (e.g. the .NET desktop "
+                                                           "runtime) to the download cache, for offline installs.")
+    cache_parser.add_argument("files", nargs="+", help="payload files to add")
+    cache_parser.add_argument("--verb", default=DOTNET_VERB, help=f"winetricks verb (default: {DOTNET_VERB})")
+    cache_parser.add_argument("--sha256", help="expected SHA-256 hash (only valid with a single file)")
+
+    subparsers.add_parser("status", help="Quickly show the state of the install.")
+
+    verify_parser = subparsers.add_parser("verify", help="Check the installed files against the install manifest, "
+                                                         "and list which stages need to be redone.")
+    verify_parser.add_argument("--deep", action="store_true",
+                               help="re-hash every file, even if its size and mtime are unchanged")
+
+    dump_parser = subparsers.add_parser("dump-manifest", help="Create a reference manifest for validating dumps "
+                                                              "from a known-good dump.")
+    dump_parser.add_argument("dump_dir", help="the dump's content directory (content/0010 for the DLC)")
+    dump_parser.add_argument("title_id", help=f"the dump's title id, e.g. {GAME_TITLE_ID}, {UPDATE_TITLE_ID} or "
+                                              f"{DLC_TITLE_ID}")
+    dump_parser.add_argument("--hashes", action="store_true", help="also record file hashes, for --deep-dump-check")
+
+    snapshot_parser = subparsers.add_parser("mirror-snapshot", help="Download the latest mod release (and Cemu) into "
+                                                                    "a directory, to be served with mirror-serve.")
+    snapshot_parser.add_argument("mirror_dir", help="mirror directory")
+    snapshot_parser.add_argument("--no-cemu", action="store_true", help="don't mirror the Cemu download")
+
+    serve_parser = subparsers.add_parser("mirror-serve", help="Serve a mirror directory over HTTP on the LAN.")
+    serve_parser.add_argument("mirror_dir", help="mirror directory")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="address to listen on (default: all)")
+    serve_parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+
+    prebuild_parser = subparsers.add_parser("prebuild", help="Check for a new mod release and, if there is one, "
+                                                             "download and merge it in the background, ready for "
+                                                             "apply-update.")
+    prebuild_parser.add_argument("--install-service", action="store_true",
+                                 help="run the prebuild periodically with a systemd user timer")
+    prebuild_parser.add_argument("--interval", default="6h",
+                                 help="time between checks for the timer, e.g. 30min or 1d (default: 6h)")
+    prebuild_parser.add_argument("--uninstall-service", action="store_true", help="remove the systemd user timer")
+
+    subparsers.add_parser("apply-update", help="Install the update prepared by prebuild.")
+
+    plan_parser = subparsers.add_parser("plan", help="Show what the installer would do (which stages would run, the "
+                                                     "files they would modify and the estimated bytes and time) "
+                                                     "without changing anything.")
+    plan_parser.add_argument("--json", action="store_true", help="print the plan as JSON")
+    plan_parser.add_argument("--offline", action="store_true", help="don't check for a new mod version")
+    plan_parser.add_argument("--detailed-exitcode", action="store_true",
+                             help=f"exit with code {EXIT_PLAN_HAS_CHANGES} if any stage would run (0 if the install "
+                                  f"is up to date)")
+
+    return parser.parse_args()
+
+
+def load_answers(args: argparse.Namespace):
+    try:
+        answers = load_answer_file(args.answers) if args.answers is not None else {}
+        for key in ANSWER_KEYS:
+            if getattr(args, key) is not None:
+                answers[key] = getattr(args, key)
+        set_answers(answers, args.unattended or args.answers is not None)
+    except (OSError, ValueError) as e:
+        print(f"Failed to load answers. Error: {e}", file=sys.stderr)
+        exit(EXIT_INVALID_ANSWER)
+
+
+def set_priority(args: argparse.Namespace):
+    if args.cgroup_weight is not None:
+        if not 1 <= args.cgroup_weight <= 10000:
+            print("--cgroup-weight must be between 1 and 10000.", file=sys.stderr)
+            exit(2)
+        run_in_cgroup(args.cgroup_weight)
+    if args.background:
+        lower_priority()
+    set_copy_rate(args.copy_rate * 1024 * 1024 if args.copy_rate else None)
+
+
+def prewarm_cache(files, verb: str, sha256: str = None):
+    if sha256 is not None and len(files) != 1:
+        print("--sha256 can only be used with a single file.", file=sys.stderr)
+        exit(1)
+    for file in files:
+        try:
+            entry = add_to_cache(file, verb, sha256)
+        except (OSError, ValueError) as e:
+            print(f"Failed to add {file} to the cache. Error: {e}", file=sys.stderr)
+            exit(1)
+        print(f"Added {entry} to the cache.")
+
+
+def build_stages(cemu_dir: str, game_dir: str, update_dir: str, dlc_dir: str, user_ids: List[str],
+                 check_for_updates: bool, deep_dump_check: bool = False, force: List[str] = ()) -> List[Stage]:
+    """
+    Describe the install as a dependency graph. The mod download -> BCML merge -> pack placement chain and the
+    shortcut -> prefix -> mod config chain don't depend on each other, so they run concurrently.
+    Each stage's inputs are checkpointed, so a rerun skips the stages that already completed with the same inputs.
+    Only the shortcut and grids stages are per Steam user; everything else is shared between the selected users.
+    Forcing the download or prefix stage redoes its work even if it looks done, so `--force` repairs damaged files.
+    """
+    from utils.dumps import get_reference_mtimes, validate_dumps
+    from utils.launcher import get_launch_options
+    from utils.mod_settings import get_graphics_pack_destinations, get_setting_json_location, \
+        get_win_settings_json_location, update_graphics_packs
+    from utils.multiplayer_mod import download_mod_files, generate_graphics_packs, get_mod_version, \
+        get_user_config_paths, place_graphics_packs, update_user_config
+    from utils.steam import add_dependencies_to_prefix, add_grids, generate_steam_shortcut, get_dotnet_paths, \
+        get_shortcut_app_id, has_grids
+
+    user_dirs = {"cemu_dir": cemu_dir, "game_dir": game_dir, "update_dir": update_dir, "dlc_dir": dlc_dir}
+
+    def download(r):
+        download_mod_files(check_for_updates, "download" in force)
+        return str(get_mod_version())
+
+    def prefix_app_ids(r) -> List[int]:
+        # the shortcut (and so the prefix) is normally the same for every user
+        return sorted(set(r["shortcut"].values()))
+
+    def add_all_grids(r):
+        for user_id, prefix_app_id in r["shortcut"].items():
+            add_grids(prefix_app_id, user_id)
+
+    def add_all_dependencies(r):
+        for prefix_app_id in prefix_app_ids(r):
+            add_dependencies_to_prefix(prefix_app_id, "prefix" in force)
+
+    def update_all_user_configs(r):
+        for prefix_app_id in prefix_app_ids(r):
+            update_user_config(cemu_dir, game_dir, update_dir, dlc_dir, prefix_app_id)
+
+    def is_placed(r):
+        return all(os.path.exists(os.path.join(destination, "rules.txt"))
+                   for destination in get_graphics_pack_destinations(cemu_dir))
+
+    def is_configured(r):
+        # every user.config in each prefix must point to our settings JSON (and the JSON must still be there)
+        if not os.path.exists(os.path.join(WORKING_DIR, "settings_windows.json")):
+            return False
+        for prefix_app_id in prefix_app_ids(r):
+            config_files = get_user_config_paths(prefix_app_id)
+            if not config_files or any(get_setting_json_location(config_file) != get_win_settings_json_location()
+                                       for config_file in config_files):
+                return False
+        return True
+
+    return [
+        # Download the latest mod files (only skippable if we aren't checking for updates)
+        Stage("download", download,
+              inputs=None if check_for_updates else lambda r: {"version": str(get_mod_version())},
+              check=lambda r: get_mod_version() is not None),
+        # Generate steam shortcut
+        Stage("shortcut", lambda r: generate_steam_shortcut(user_ids),
+              inputs=lambda r: {"user_ids": user_ids, "mod_dir": MOD_DIR, "launch_options": get_launch_options()},
+              check=lambda r: all(get_shortcut_app_id(user_id) is not None for user_id in user_ids)),
+        # Add grid data
+        Stage("grids", add_all_grids, ("shortcut",), inputs=lambda r: {},
+              check=lambda r: all(has_grids(app_id, user_id) for user_id, app_id in r["shortcut"].items())),
+        # Add dependencies to prefix (this launches the mod, so it needs the mod files)
+        Stage("prefix", add_all_dependencies, ("download", "shortcut", "grids"), inputs=lambda r: {},
+              check=lambda r: all(os.path.exists(path) for prefix_app_id in prefix_app_ids(r)
+                                  for path in get_dotnet_paths(prefix_app_id))),
+        # Generate the graphics packs from the mod files
+        # Make sure the dumps are complete before spending minutes merging them. A deep check is requested by failing
+        # the stage's check rather than through its inputs, so that it doesn't change the fingerprint the merge
+        # depends on (and a deep check of an unchanged install doesn't redo the merge)
+        Stage("dumps", lambda r: validate_dumps(game_dir, update_dir, dlc_dir, deep_dump_check),
+              inputs=lambda r: {"game_dir": game_dir, "update_dir": update_dir, "dlc_dir": dlc_dir,
+                                "references": get_reference_mtimes()},
+              check=lambda r: not deep_dump_check),
+        Stage("generate", lambda r: generate_graphics_packs(game_dir, update_dir, dlc_dir), ("download", "dumps"),
+              inputs=lambda r: {"game_dir": game_dir, "update_dir": update_dir, "dlc_dir": dlc_dir},
+              check=lambda r: os.path.exists(os.path.join(r["generate"], "rules.txt"))),
+        # Place the graphics packs in cemu & verify they're in the settings.xml
+        Stage("place", lambda r: place_graphics_packs(cemu_dir, r["generate"]), ("generate",),
+              inputs=lambda r: {"cemu_dir": cemu_dir}, check=is_placed),
+        # (cheap, and Cemu may rewrite settings.xml at any time, so this always runs)
+        Stage("settings", lambda r: update_graphics_packs(cemu_dir), ("place",)),
+        # Point the mod to the correct directories
+        Stage("config", update_all_user_configs, ("prefix",), inputs=lambda r: user_dirs, check=is_configured),
+    ]
+
+
+def run_mirror_command(args: argparse.Namespace):
+    import requests
+
+    from utils.mirror import serve_mirror, snapshot_mirror
+
+    try:
+        if args.command == "mirror-snapshot":
+            snapshot_mirror(args.mirror_dir, not args.no_cemu)
+            print(f"Mirror snapshot in {args.mirror_dir} is up to date.")
+        else:
+            serve_mirror(args.mirror_dir, args.host, args.port)
+    except (OSError, RuntimeError, requests.RequestException) as e:
+        print(f"Mirror failed. Error: {e}", file=sys.stderr)
+        exit(1)
+
+
+def run_prebuild(args: argparse.Namespace):
+    import subprocess
+
+    import requests
+
+    from utils.prebuild import install_lock, install_service, prebuild, uninstall_service
+
+    try:
+        if args.install_service:
+            install_service(os.path.dirname(os.path.abspath(__file__)), args.interval, args.mirror)
+            print(f"Installed the background update timer (every {args.interval}).")
+            return
+        if args.uninstall_service:
+            uninstall_service()
+            print("Removed the background update timer.")
+            return
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Failed to set up the systemd timer. Error: {e}", file=sys.stderr)
+        exit(1)
+
+    # stay out of the way of Steam and games (the systemd service also sets this, but not when run by hand)
+    lower_priority()
+    try:
+        with install_lock(wait=False):
+            prebuild(load_state(STATE_PATH))
+    except BlockingIOError:
+        print("The installer is running, skipping this check.")
+    except (OSError, RuntimeError, ValueError, requests.RequestException) as e:
+        print(f"Failed to prepare the update. Error: {e}", file=sys.stderr)
+        exit(1)
+
+
+def apply_update():
+    """
+    Swap the update prepared by prebuild into place, then run the install stages so the checkpoint matches. The
+    stages the prebuild already did are recorded without rerunning them.
+    """
+    from utils.launcher import install_launcher
+    from utils.prebuild import apply_staged_update, get_installed_dirs, get_staged_update, install_lock
+    from utils.steam import select_steam_users
+
+    with install_lock():
+        staged = get_staged_update()
+        if staged is None:
+            print("There is no prepared update to apply.")
+            return
+        state = load_state(STATE_PATH)
+        dirs = staged["dirs"]
+        if get_installed_dirs(state) != dirs:
+            print("The install has changed since the update was prepared. Please rerun the installer instead.",
+                  file=sys.stderr)
+            exit(1)
+        # the shortcut stage may never have completed (e.g. an install interrupted by a manual step)
+        user_ids = (state.get("shortcut", {}).get("inputs") or {}).get("user_ids")
+        if user_ids is None:
+            user_ids = select_steam_users()
+
+        apply_staged_update(staged, state["generate"]["result"])
+        install_launcher()
+        stages = build_stages(dirs["cemu_dir"], dirs["game_dir"], dirs["update_dir"], dirs["dlc_dir"], user_ids, False)
+        prebuilt = {
+            "generate": lambda r: state["generate"]["result"],
+            "place": lambda r: None,
+        }
+        stages = [stage._replace(func=prebuilt[stage.name]) if stage.name in prebuilt else stage for stage in stages]
+        # the prefix only depends on the mod files because setting it up launches the mod
+        stages = [stage._replace(func=lambda r, stage=stage: None if stage.check(r) else stage.func(r))
+                  if stage.name == "prefix" else stage for stage in stages]
+        try:
+            results = run_stages(stages, state_path=STATE_PATH)
+        except ManualStepRequired as e:
+            print(f"\n{e}", file=sys.stderr)
+            print("The update is in place. Please do this, then rerun the installer to finish it.", file=sys.stderr)
+            exit(EXIT_MANUAL_STEP_REQUIRED)
+        # the prebuild's manifest entries were moved in with the files, so this only hashes files that changed since
+        record_install(results, dirs["cemu_dir"])
+    print(f"Updated the BOTWM mod to version {staged['version']}.")
+
+
+def show_plan(args: argparse.Namespace):
+    """
+    Plan an install for the directories and Steam users of the existing install (or the ones given as answers).
+    """
+    from utils.plan import make_plan, print_plan
+    from utils.prebuild import get_installed_dirs
+    from utils.steam import select_steam_users
+
+    state = load_state(STATE_PATH)
+    dirs = get_installed_dirs(state) or {}
+    for key in ["cemu_dir", "game_dir", "update_dir", "dlc_dir"]:
+        if get_answer(key) is not None:
+            dirs[key] = get_answer(key)
+    if len(dirs) < 4:
+        print("The mod hasn't been installed yet. To plan a first install, pass --cemu-dir, --game-dir, --update-dir "
+              "and --dlc-dir.", file=sys.stderr)
+        exit(1)
+    user_ids = (state.get("shortcut", {}).get("inputs") or {}).get("user_ids")
+    if user_ids is None or get_answer("steam_user") is not None:
+        user_ids = select_steam_users()
+    check_for_updates = get_answer("check_for_updates")
+
+    stages = build_stages(dirs["cemu_dir"], dirs["game_dir"], dirs["update_dir"], dirs["dlc_dir"], user_ids,
+                          check_for_updates is not False, args.deep_dump_check)
+    try:
+        plan = make_plan(stages, dirs["cemu_dir"], user_ids, check_for_updates is not False, args.force,
+                         args.deep_dump_check, args.offline)
+    except ValueError as e:
+        print(f"Invalid install stages: {e}", file=sys.stderr)
+        exit(1)
+    if args.json:
+        print(json.dumps(plan, indent=4))
+    else:
+        print_plan(plan)
+    if args.detailed_exitcode and any(step["run"] for step in plan):
+        exit(EXIT_PLAN_HAS_CHANGES)
+
+
+def get_installed_roots(results: Dict[str, Any], cemu_dir: str) -> Dict[str, List[str]]:
+    """
+    Get the files/directories each stage installed, for the install manifest.
+    """
+    from utils.mod_settings import get_graphics_pack_destinations
+    from utils.steam import get_dotnet_paths
+
+    prefix_app_ids = sorted(set(results["shortcut"].values()))
+    return {
+        "download": [MOD_DIR],
+        "generate": [results["generate"]],
+        "place": list(get_graphics_pack_destinations(cemu_dir)),
+        "prefix": [os.path.dirname(path) for prefix_app_id in prefix_app_ids
+                   for path in get_dotnet_paths(prefix_app_id)],
+    }
+
+
+def record_install(results: Dict[str, Any], cemu_dir: str):
+    """
+    Record what was installed, so `main.py verify` can check it later and the launch wrapper can spot drift.
+    """
+    from utils.integrity import write_manifest
+    from utils.launcher import record_launch_state
+    from utils.mod_settings import get_graphics_pack_destinations
+    from utils.multiplayer_mod import get_user_config_paths
+
+    write_manifest(get_installed_roots(results, cemu_dir))
+    user_configs = [config_file for prefix_app_id in sorted(set(results["shortcut"].values()))
+                    for config_file in get_user_config_paths(prefix_app_id)]
+    record_launch_state(cemu_dir, results["generate"], list(get_graphics_pack_destinations(cemu_dir)), user_configs)
+
+
+def verify(deep: bool):
+    from utils.integrity import verify_install
+
+    try:
+        problems = verify_install(deep)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    if not problems:
+        print("All installed files are intact.")
+        return
+    for stage, stage_problems in problems.items():
+        print(f"Stage '{stage}' needs to be redone ({len(stage_problems)} problem(s)):")
+        for path, problem in stage_problems[:20]:
+            print(f"  {problem}: {path}")
+        if len(stage_problems) > 20:
+            print(f"  ... and {len(stage_problems) - 20} more")
+    print("To repair, rerun the installer with: " + " ".join(f"--force {stage}" for stage in problems))
+    exit(1)
+
+
+def create_dump_reference(dump_dir: str, title_id: str, with_hashes: bool):
+    from utils.dumps import create_reference
+
+    dump_dir = os.path.expanduser(dump_dir)
+    if not os.path.isdir(dump_dir):
+        print(f"{dump_dir} is not a directory.", file=sys.stderr)
+        exit(1)
+    print(f"Wrote {create_reference(dump_dir, title_id, with_hashes)}")
+
+
+def main(force: List[str], deep_dump_check: bool, profile: bool):
+    from utils.cemu import get_user_paths
+    from utils.launcher import install_launcher
+    from utils.multiplayer_mod import should_check_for_updates
+    from utils.prebuild import get_staged_update, install_lock, load_prebuild_state, remove_outdated_staging
+    from utils.steam import confirm_steam_close, is_valid_steam_installation, select_steam_users
+    from utils.tracing import end_run, print_report, span, start_run, traced
 
-def main():
     if not is_valid_steam_installation(STEAM_DIR):
         print("Steam installation not found. Please install Steam before running this script.", file=sys.stderr)
         print(f"(Note, we currently only look for Steam in {STEAM_DIR})", file=sys.stderr)
         exit(1)
 
-    cemu_dir, game_dir, update_dir, dlc_dir = get_user_paths()
-    # Generate the working directory
-    os.makedirs(WORKING_DIR, exist_ok=True)
+    # trace the prompts too, so the Cemu download they may start is recorded
+    start_run(profile)
+    try:
+        # Ask all questions up front, so the stages below can run unattended (and concurrently)
+        cemu_dir, game_dir, update_dir, dlc_dir = get_user_paths()
+        check_for_updates = should_check_for_updates()
+        confirm_steam_close()
+        user_ids = select_steam_users()
+        manual_steps = wait_for_confirmation("If a step can't be done automatically (e.g. launching the mod to set up "
+                                             "its prefix), do you want to do it by hand when asked? Otherwise the "
+                                             "installer exits with instructions. [Y/n]: ", "manual_steps", False)
 
-    # Download the latest mod files
-    download_mod_files()
+        # Generate the working directory
+        os.makedirs(WORKING_DIR, exist_ok=True)
+        # the shortcut runs the installed launch wrapper, so keep it up to date with this installer
+        install_launcher()
 
-    # Generate steam shortcut
-    prefix_app_id, user_id = generate_steam_shortcut()
+        staged = get_staged_update()
+        if staged is not None:
+            print(f"BOTWM mod version {staged['version']} was already prepared in the background. "
+                  f"`main.py apply-update` installs it without downloading and merging it again.")
 
-    # Add grid data
-    add_grids(prefix_app_id, user_id)
+        stages = build_stages(cemu_dir, game_dir, update_dir, dlc_dir, user_ids, check_for_updates, deep_dump_check,
+                              force)
+        completed = set()  # stages that ran successfully in this run
 
-    # Add dependencies to prefix
-    add_dependencies_to_prefix(prefix_app_id)
+        def run_stage(stage: Stage):
+            func = traced(stage.name, stage.func, stage=True)
 
-    # Generate the graphics packs from the mod files
-    bcml_dir = generate_graphics_packs(game_dir, update_dir, dlc_dir)
+            def run(r):
+                result = func(r)
+                completed.add(stage.name)
+                return result
+            return stage._replace(func=run)
 
-    # Place the graphics packs in cemu & verify they're in the settings.xml
-    place_graphics_packs(cemu_dir, bcml_dir)
-    update_graphics_packs(cemu_dir)
+        # the background prebuild uses the same BCML config and working files, so don't run at the same time
+        with install_lock():
+            try:
+                while True:
+                    try:
+                        # only one profiler can run at a time, so profiled stages run one after another
+                        results = run_stages([run_stage(stage) for stage in stages], max_workers=1 if profile else 4,
+                                             state_path=STATE_PATH, force=force)
+                        break
+                    except ManualStepRequired as e:
+                        # the stages don't prompt themselves, so they can't hold up or interleave with each other
+                        print(f"\n{e}", file=sys.stderr)
+                        if not manual_steps:
+                            print("Please do this, then rerun the installer.", file=sys.stderr)
+                            exit(EXIT_MANUAL_STEP_REQUIRED)
+                        wait_for_enter("Once you have done this, press enter to continue: ")
+                        # completed stages are skipped on the retry, so only the forced ones still to run stay forced
+                        force = sorted(get_dependents(stages, force) - completed)
+                        stages = build_stages(cemu_dir, game_dir, update_dir, dlc_dir, user_ids, check_for_updates,
+                                              deep_dump_check, force)
 
-    # Point the mod to the correct directories
-    update_user_config(cemu_dir, game_dir, update_dir, dlc_dir, prefix_app_id)
+                print("Recording install manifest...")
+                with span("write_manifest"):
+                    record_install(results, cemu_dir)
+                # an update prepared in the background is useless once the installer has reached its version
+                remove_outdated_staging(load_prebuild_state())
+            except ValueError as e:
+                print(f"Invalid install stages: {e}", file=sys.stderr)
+                exit(1)
+    finally:
+        print_report(end_run())
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    load_answers(args)
+    set_mirror_url(args.mirror)
+    set_priority(args)
+    if args.command == "status":
+        from utils.status import print_status
+        print_status()
+    elif args.command == "verify":
+        verify(args.deep)
+    elif args.command == "cache-add":
+        prewarm_cache(args.files, args.verb, args.sha256)
+    elif args.command in ("mirror-snapshot", "mirror-serve"):
+        run_mirror_command(args)
+    elif args.command == "dump-manifest":
+        create_dump_reference(args.dump_dir, args.title_id, args.hashes)
+    elif args.command == "prebuild":
+        run_prebuild(args)
+    elif args.command == "apply-update":
+        apply_update()
+    elif args.command == "plan":
+        show_plan(args)
+    else:
+        main(args.force, args.deep_dump_check, args.profile)
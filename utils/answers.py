@@ -0,0 +1,71 @@
+"""
+Functions for answering the installer's prompts from an answer file and command line flags (unattended mode).
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+# steam_user: Steam user id or persona name to install for (or a list of them, or "all")
+# cemu_dir, game_dir, update_dir, dlc_dir: directories to use instead of detecting/asking for them
+# check_for_updates, scan_for_cemu, download_cemu, manual_steps: answers to the corresponding yes/no prompts
+ANSWER_KEYS = ["steam_user", "cemu_dir", "game_dir", "update_dir", "dlc_dir",
+               "check_for_updates", "scan_for_cemu", "download_cemu", "manual_steps"]
+# answers to yes/no prompts have to be real booleans ("no" or 0 would otherwise be taken as yes)
+BOOLEAN_ANSWER_KEYS = ["check_for_updates", "scan_for_cemu", "download_cemu", "manual_steps"]
+
+_answers: Dict[str, Any] = {}
+_unattended = False
+
+
+def load_answer_file(path: str) -> Dict[str, Any]:
+    """
+    Load an answer file. Files ending in .toml are parsed as TOML (needs Python 3.11+), everything else as JSON.
+    :param path: path to the answer file
+    :return: dict of answers
+    """
+    if path.endswith(".toml"):
+        try:
+            import tomllib  # Python 3.11+
+        except ImportError:
+            raise ValueError("TOML answer files need Python 3.11 or newer; please use a JSON answer file instead")
+        with open(path, "rb") as answer_file:
+            answers = tomllib.load(answer_file)
+    else:
+        with open(path, "r") as answer_file:
+            answers = json.load(answer_file)
+    if not isinstance(answers, dict):
+        raise ValueError("Answer file must contain a table/object of answers")
+    return answers
+
+
+def set_answers(answers: Dict[str, Any], unattended: bool):
+    """
+    Set the answers used for prompts.
+    :param answers: dict of answers, keyed by ANSWER_KEYS (None values are ignored, yes/no answers must be booleans)
+    :param unattended: if True, never prompt: detected values are accepted, and prompts without an answer end the
+                       installer instead of waiting for input
+    """
+    global _answers, _unattended
+    unknown = set(answers) - set(ANSWER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown answer(s): {', '.join(sorted(unknown))}")
+    _answers = {key: value for key, value in answers.items() if value is not None}
+    not_booleans = [key for key in BOOLEAN_ANSWER_KEYS if key in _answers and not isinstance(_answers[key], bool)]
+    if not_booleans:
+        raise ValueError(f"Answer(s) must be true or false: {', '.join(not_booleans)}")
+    for key in ["cemu_dir", "game_dir", "update_dir", "dlc_dir"]:
+        if key in _answers:
+            _answers[key] = os.path.expanduser(str(_answers[key]))
+    _unattended = unattended
+
+
+def get_answer(key: str) -> Optional[Any]:
+    """
+    Get the answer for the given key, or None if it wasn't answered.
+    """
+    return _answers.get(key)
+
+
+def is_unattended() -> bool:
+    return _unattended
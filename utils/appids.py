@@ -6,11 +6,12 @@ https://github.com/SteamGridDB/steam-rom-manager/blob/dc8500ebe7df467f310b1d36fb
 """
 
 
-import crc32c
 import ctypes
 
 
 def generate_preliminary_id(exe: str, appname: str) -> int:
+    import crc32c  # only needed when generating a new shortcut, so keep it off the startup path
+
     key = exe + appname
     top = ctypes.c_uint32(crc32c.crc32c(key.encode("ascii"))).value | 0x80000000
     return (top << 32) | 0x02000000
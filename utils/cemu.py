@@ -10,15 +10,16 @@ import zipfile
 from typing import Optional, Tuple
 from xml.etree import ElementTree as ET
 
-import requests
-
-from utils.common import CEMU_URL, wait_for_confirmation
-from utils.paths import check_path, get_directory, get_path, get_sd_path
+from utils.common import get_cemu_url, wait_for_confirmation
+from utils.dumps import DLC_TITLE_ID, GAME_TITLE_ID, UPDATE_TITLE_ID
+from utils.paths import check_path, get_answered_path, get_directory, get_path, get_sd_path
+from utils.tracing import span
 
 
 def scan_for_cemu() -> Optional[str]:
     confirmation = wait_for_confirmation(f"Do you want to automatically look for a Cemu installation? This will scan "
-                                         f"your home directory for Cemu.exe and may take a while. [Y/n]: ")
+                                         f"your home directory for Cemu.exe and may take a while. [Y/n]: ",
+                                         "scan_for_cemu", False)
     if confirmation:
         try:
             print("Press ctrl+C at any time to end the scan.")
@@ -32,10 +33,13 @@ def scan_for_cemu() -> Optional[str]:
 
 
 def download_cemu() -> Optional[str]:
-    confirmation = wait_for_confirmation(f"Do you want to download Cemu now? [Y/n]: ")
+    confirmation = wait_for_confirmation(f"Do you want to download Cemu now? [Y/n]: ", "download_cemu", False)
     if confirmation:
+        import requests
+
         try:
-            z = zipfile.ZipFile(io.BytesIO(requests.get(CEMU_URL).content))
+            with span("download_cemu"):
+                z = zipfile.ZipFile(io.BytesIO(requests.get(get_cemu_url()).content))
             wiiu_dir = os.path.expanduser("~/Emulation/roms/wiiu/")
             os.makedirs(wiiu_dir, exist_ok=True)
             z.extractall(wiiu_dir)
@@ -61,6 +65,10 @@ def download_cemu() -> Optional[str]:
 
 
 def get_cemu_dir() -> str:
+    answered_dir = get_answered_path("cemu_dir", dir_includes=["Cemu.exe", "settings.xml"])
+    if answered_dir is not None:
+        return answered_dir
+
     # Check for EmuDeck dirs
     is_valid, reason, emudeck_cemu_dir = check_path(
         os.path.expanduser("~/Emulation/roms/wiiu"), dir_includes=["Cemu.exe", "settings.xml"])
@@ -73,7 +81,8 @@ def get_cemu_dir() -> str:
     cemu_dir = None
 
     if is_valid:
-        confirmation = wait_for_confirmation(f"Is this your Cemu directory? \n{emudeck_cemu_dir}\n[Y/n]: ")
+        confirmation = wait_for_confirmation(f"Is this your Cemu directory? \n{emudeck_cemu_dir}\n[Y/n]: ",
+                                             default=True)
         if confirmation:
             cemu_dir = emudeck_cemu_dir
     if cemu_dir is None:
@@ -105,23 +114,25 @@ def get_user_paths() -> Tuple[str, str, str, str]:
         root = tree.getroot()
 
     # Find the paths with a specific titleId
-    game_title_id = "00050000101c9400"
+    game_title_id = GAME_TITLE_ID
     game_sub_folders = {"Layout": ["Horse.sblarc"]}
     installed_game_dir = os.path.join(cemu_dir, "mlc01/usr/title/0005000/101c9400/content")
-    game_dir = get_directory(root, installed_game_dir, game_title_id, "content", game_sub_folders, None, "Game")
+    game_dir = get_directory(root, installed_game_dir, game_title_id, "content", game_sub_folders, None, "Game",
+                             "game_dir")
 
     # Find the paths for update
-    update_title_id = "0005000e101c9400"
+    update_title_id = UPDATE_TITLE_ID
     update_sub_folders = {"Actor/Pack": ["ActorObserverByActorTagTag.sbactorpack"]}
     installed_update_dir = os.path.join(cemu_dir, "mlc01/usr/title/0005000e/101c9400/content")
     update_dir = get_directory(root, installed_update_dir, update_title_id, "content", update_sub_folders,
-                               None, "Update")
+                               None, "Update", "update_dir")
 
     # Find the paths for dlc
-    dlc_title_id = "0005000c101c9400"
+    dlc_title_id = DLC_TITLE_ID
     dlc_sub_folders = {"Movie": ["Demo655_0.mp4"]}
     installed_dlc_dir = os.path.join(cemu_dir, "mlc01/usr/title/0005000c/101c9400/content/0010")
-    dlc_dir = get_directory(root, installed_dlc_dir, dlc_title_id, "content/0010", dlc_sub_folders, None, "DLC")
+    dlc_dir = get_directory(root, installed_dlc_dir, dlc_title_id, "content/0010", dlc_sub_folders, None, "DLC",
+                            "dlc_dir")
 
     # !!IMPORTANT!! the tests I used to check each directory may not work for everyone. This is based upon my files and
     # my files may be messed up who knows. Double check these with your files to see if the tests work for you too :)
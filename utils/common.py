@@ -1,7 +1,12 @@
 import collections
 import os
 import subprocess
+import sys
 import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from utils.answers import get_answer, is_unattended
 
 Shortcut = collections.namedtuple("Shortcut", ["name", "exe", "startdir", "icon", "tags"])
 
@@ -9,11 +14,83 @@ DOWNLOAD_URL = "https://api.github.com/repos/edgarcantuco/BOTW.Release/releases"
 WORKING_DIR = os.path.expanduser("~/.local/share/botwminstaller")
 MOD_DIR = os.path.join(WORKING_DIR, "BreathOfTheWildMultiplayer")
 STEAM_DIR = os.path.expanduser("~/.steam/steam")
+STATE_PATH = os.path.join(WORKING_DIR, "install_state.json")  # checkpoint of which install stages have completed
 
 CEMU_URL = "https://cemu.info/releases/cemu_1.27.1.zip"  # where to download the Cemu zip from
 
+_mirror_url = None  # base URL of a LAN mirror (see utils.mirror) to download from instead, if set
+
+# Exit codes (1 is used for all other errors, 2 by argparse for invalid arguments)
+EXIT_ANSWER_REQUIRED = 3  # unattended mode hit a prompt that has no answer
+EXIT_INVALID_ANSWER = 4  # an answer was given, but isn't valid
+EXIT_MANUAL_STEP_REQUIRED = 5  # unattended mode hit a step the user has to do by hand
+EXIT_PLAN_HAS_CHANGES = 6  # `plan --detailed-exitcode`: the install isn't up to date
+
+
+class ManualStepRequired(Exception):
+    """
+    Raised by an install stage when the user has to do a step by hand. Stages run concurrently, so they don't prompt
+    themselves: the installer shows the message once the running stages have finished, waits for the user (if they
+    agreed to do manual steps up front) and then retries the stages that didn't complete.
+    """
+
+
+def set_mirror_url(mirror_url: Optional[str]):
+    global _mirror_url
+    _mirror_url = mirror_url.rstrip("/") if mirror_url else None
+
+
+def get_download_url() -> str:
+    """
+    Get the URL of the mod's releases JSON (from the mirror, if one is set).
+    """
+    return f"{_mirror_url}/releases.json" if _mirror_url else DOWNLOAD_URL
+
+
+def get_cemu_url() -> str:
+    """
+    Get the URL of the Cemu zip (from the mirror, if one is set).
+    """
+    return f"{_mirror_url}/cemu/{os.path.basename(urlparse(CEMU_URL).path)}" if _mirror_url else CEMU_URL
+
+
+def get_asset_url(asset_url: str) -> str:
+    """
+    Rewrite a release asset's download URL to point at the mirror, if one is set.
+    """
+    return f"{_mirror_url}/assets/{os.path.basename(urlparse(asset_url).path)}" if _mirror_url else asset_url
+
+
+def exit_answer_required(prompt: str):
+    print(f"Unattended mode: no answer given for the prompt:\n{prompt}", file=sys.stderr)
+    exit(EXIT_ANSWER_REQUIRED)
+
+
+def wait_for_enter(prompt: str = ""):
+    """
+    Wait for the user to press enter after doing something manually, or exit in unattended mode.
+    """
+    if is_unattended():
+        print(f"{prompt}\nUnattended mode: this step has to be done manually, exiting.", file=sys.stderr)
+        exit(EXIT_MANUAL_STEP_REQUIRED)
+    input(prompt)
+
 
-def wait_for_confirmation(prompt: str) -> bool:
+def wait_for_confirmation(prompt: str, answer_key: str = None, default: bool = None) -> bool:
+    """
+    Ask the user a yes/no question.
+    :param prompt: the question to show
+    :param answer_key: key of the answer to use instead of asking, if given (see utils.answers)
+    :param default: answer to use in unattended mode if there is no answer (None means an answer is required)
+    :return: True if the user answered yes
+    """
+    if answer_key is not None and get_answer(answer_key) is not None:
+        return get_answer(answer_key)
+    if is_unattended():
+        if default is None:
+            exit_answer_required(prompt)
+        print(f"{prompt}{'y' if default else 'n'} (unattended)")
+        return default
     while (confirmation := str(input(prompt)).lower()) not in ["y", "n"]:
         pass
     return True if confirmation == "y" else False
@@ -33,7 +110,6 @@ def wait_for_file(file_path: str, timeout: float):
 def terminate_program(process_name: str, display_name: str = None):
     if display_name is None:
         display_name = process_name
-    # Wait for the user to press enter to proceed
     try:
         subprocess.run(["killall", "-w", process_name], check=True, timeout=30, capture_output=True, text=True)
         print(f"Successfully closed '{display_name}'.")
@@ -41,10 +117,7 @@ def terminate_program(process_name: str, display_name: str = None):
         if "no process found" in e.stderr.lower():
             print(f"{display_name} was already closed.")
         else:
-            input(
-                f"This program does not have the correct permissions to close {display_name}.\n"
-                f"Please close {display_name} manually, then press enter to continue:")
+            raise ManualStepRequired(f"This program does not have the correct permissions to close {display_name}.\n"
+                                     f"Please close {display_name} manually.")
     except subprocess.TimeoutExpired:
-        input(
-            f"It took too long to close {display_name}!\n"
-            f"Please close {display_name} manually, then press enter to continue:")
+        raise ManualStepRequired(f"It took too long to close {display_name}!\nPlease close {display_name} manually.")
@@ -0,0 +1,152 @@
+"""
+Functions for validating the game, update and DLC dumps against reference manifests before the BCML merge.
+"""
+
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+from utils.common import WORKING_DIR
+from utils.integrity import get_default_algorithm, hash_files, list_files
+
+GAME_TITLE_ID = "00050000101c9400"
+UPDATE_TITLE_ID = "0005000e101c9400"
+DLC_TITLE_ID = "0005000c101c9400"
+
+# reference manifests, one <title id>.json per title, shipped with the installer
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dump_manifests")
+HASH_CACHE_PATH = os.path.join(WORKING_DIR, "dump_hash_cache.json")
+
+
+def get_reference_path(title_id: str) -> str:
+    return os.path.join(REFERENCE_DIR, f"{title_id.lower()}.json")
+
+
+def get_reference_mtimes() -> Dict[str, Optional[int]]:
+    """
+    Get the modification time of each title's reference manifest (None if there is none), so that validated dumps
+    are validated again when a reference is added or changed.
+    """
+    mtimes = {}
+    for title_id in [GAME_TITLE_ID, UPDATE_TITLE_ID, DLC_TITLE_ID]:
+        try:
+            mtimes[title_id] = os.stat(get_reference_path(title_id)).st_mtime_ns
+        except OSError:
+            mtimes[title_id] = None
+    return mtimes
+
+
+def hash_dump_files(paths: List[str], algorithm: str) -> Dict[str, str]:
+    """
+    Hash dump files in parallel, reusing cached hashes for files whose (device, inode, size, mtime) are unchanged.
+    :return: dict of path to hash (None if the file couldn't be read)
+    """
+    cache = {}
+    if os.path.exists(HASH_CACHE_PATH):
+        try:
+            with open(HASH_CACHE_PATH, "r") as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            cache = {}
+
+    keys = {}
+    for path in paths:
+        st = os.stat(path)
+        keys[path] = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{algorithm}"
+    to_hash = [path for path in paths if keys[path] not in cache]
+    hashes = hash_files(to_hash, algorithm)
+    for path, digest in hashes.items():
+        if digest is not None:
+            cache[keys[path]] = digest
+
+    if to_hash:
+        os.makedirs(WORKING_DIR, exist_ok=True)
+        with open(HASH_CACHE_PATH + ".tmp", "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(HASH_CACHE_PATH + ".tmp", HASH_CACHE_PATH)
+    return {path: cache.get(keys[path]) for path in paths}
+
+
+def create_reference(dump_dir: str, title_id: str, with_hashes: bool = False) -> str:
+    """
+    Create a reference manifest from a known-good dump.
+    :param dump_dir: the dump's content directory (content/0010 for the DLC)
+    :param title_id: the dump's title id
+    :param with_hashes: also record file hashes, for deep validation
+    :return: path of the written reference manifest
+    """
+    files = {os.path.relpath(path, dump_dir): os.path.getsize(path) for path in list_files(dump_dir)}
+    reference = {"title_id": title_id.lower(), "file_count": len(files), "total_size": sum(files.values()),
+                 "files": files}
+    if with_hashes:
+        algorithm = get_default_algorithm()
+        hashes = hash_dump_files([os.path.join(dump_dir, path) for path in files], algorithm)
+        reference["algorithm"] = algorithm
+        reference["hashes"] = {os.path.relpath(path, dump_dir): digest for path, digest in hashes.items()}
+
+    reference_path = get_reference_path(title_id)
+    os.makedirs(REFERENCE_DIR, exist_ok=True)
+    with open(reference_path, "w") as reference_file:
+        json.dump(reference, reference_file, indent=1, sort_keys=True)
+    return reference_path
+
+
+def validate_dump(dump_dir: str, title_id: str, deep: bool = False) -> List[str]:
+    """
+    Check a dump's file count and file sizes (and with deep, its file hashes) against the reference manifest for its
+    title id. If there is no reference manifest, only the marker file checks done when the directory was picked apply.
+    A reference may leave out the file count, or give a file's size as null to only require that it exists.
+    :param dump_dir: the dump's content directory (content/0010 for the DLC)
+    :param title_id: the dump's title id
+    :param deep: also compare file hashes (if the reference manifest has them)
+    :return: list of problems (empty if the dump is valid)
+    """
+    reference_path = get_reference_path(title_id)
+    if not os.path.exists(reference_path):
+        print(f"No reference manifest for title {title_id}, skipping full validation of {dump_dir}.",
+              file=sys.stderr)
+        return []
+    with open(reference_path, "r") as reference_file:
+        reference = json.load(reference_file)
+
+    problems = []
+    actual = {os.path.relpath(path, dump_dir): path for path in list_files(dump_dir)}
+    if len(actual) < reference.get("file_count", 0):
+        problems.append(f"{dump_dir} has {len(actual)} files, expected {reference['file_count']}")
+    for rel_path, size in reference["files"].items():
+        if rel_path not in actual:
+            problems.append(f"missing: {rel_path}")
+        elif size is not None and os.path.getsize(actual[rel_path]) != size:
+            problems.append(f"wrong size: {rel_path}")
+
+    if deep and "hashes" not in reference:
+        print(f"The reference manifest for title {title_id} has no file hashes, so {dump_dir} can't be deep checked "
+              f"(only its files and sizes were checked).", file=sys.stderr)
+    elif deep and not problems:
+        hashes = hash_dump_files([actual[rel_path] for rel_path in reference["hashes"]], reference["algorithm"])
+        for rel_path, digest in reference["hashes"].items():
+            if hashes[actual[rel_path]] != digest:
+                problems.append(f"wrong contents: {rel_path}")
+    return problems
+
+
+def validate_dumps(game_dir: str, update_dir: str, dlc_dir: str, deep: bool = False):
+    """
+    Validate the game, update and DLC dumps, exiting with a list of problems if any of them is incomplete.
+    """
+    failed = False
+    for dump_dir, title_id, name in [(game_dir, GAME_TITLE_ID, "Game"), (update_dir, UPDATE_TITLE_ID, "Update"),
+                                     (dlc_dir, DLC_TITLE_ID, "DLC")]:
+        problems = validate_dump(dump_dir, title_id, deep)
+        if problems:
+            failed = True
+            print(f"BOTW {name} dump at {dump_dir} is incomplete or damaged ({len(problems)} problem(s)):",
+                  file=sys.stderr)
+            for problem in problems[:20]:
+                print(f"  {problem}", file=sys.stderr)
+            if len(problems) > 20:
+                print(f"  ... and {len(problems) - 20} more", file=sys.stderr)
+    if failed:
+        print("Please re-dump the files listed above, then rerun the installer.", file=sys.stderr)
+        exit(1)
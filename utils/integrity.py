@@ -0,0 +1,195 @@
+"""
+Functions for recording a hash manifest of the installed files and verifying the install against it.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.common import WORKING_DIR
+
+MANIFEST_PATH = os.path.join(WORKING_DIR, "install_manifest.json")
+
+
+def get_hasher(algorithm: str) -> Callable:
+    """
+    Get a constructor for the given hash algorithm ("xxh3_128" needs the xxhash package, which BCML depends on).
+    """
+    if algorithm == "xxh3_128":
+        import xxhash
+        return xxhash.xxh3_128
+    if algorithm == "blake2b":
+        return lambda: hashlib.blake2b(digest_size=32)
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+def get_default_algorithm() -> str:
+    """
+    Use xxHash if it is available, since it is several times faster than BLAKE2.
+    """
+    try:
+        import xxhash  # noqa: F401
+        return "xxh3_128"
+    except ImportError:
+        return "blake2b"
+
+
+def hash_file(path: str, algorithm: str = "blake2b") -> str:
+    """
+    Hash a file, reading it through mmap. The hash functions release the GIL while hashing, so this can be run on
+    a thread pool.
+    """
+    hasher = get_hasher(algorithm)()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+    return hasher.hexdigest()
+
+
+def hash_files(paths: List[str], algorithm: str) -> Dict[str, Optional[str]]:
+    """
+    Hash files in parallel.
+    :return: dict of path to hash (None if the file couldn't be read)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def hash_or_none(path: str) -> Optional[str]:
+        try:
+            return hash_file(path, algorithm)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as executor:
+        return dict(zip(paths, executor.map(hash_or_none, paths)))
+
+
+def list_files(root: str) -> List[str]:
+    """
+    List all files under root (or root itself, if it is a file).
+    """
+    if os.path.isfile(root):
+        return [root]
+    return [os.path.join(dir_path, file) for dir_path, _, files in os.walk(root) for file in files]
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> Optional[Dict]:
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        print("Install manifest is unreadable.", file=sys.stderr)
+        return None
+
+
+def write_manifest(stage_roots: Dict[str, List[str]], manifest_path: str = MANIFEST_PATH):
+    """
+    Record the size, mtime and hash of every file the given stages installed. Files whose size and mtime match the
+    previous manifest aren't hashed again.
+    :param stage_roots: dict of stage name to the files/directories that stage installed
+    :param manifest_path: where to write the manifest
+    """
+    previous = load_manifest(manifest_path) or {}
+    algorithm = previous.get("algorithm") or get_default_algorithm()
+    previous_files = {path: entry for stage in previous.get("stages", {}).values()
+                      for path, entry in stage["files"].items()}
+
+    manifest = {"algorithm": algorithm, "stages": {}}
+    to_hash = []
+    for stage, roots in stage_roots.items():
+        files = {}
+        for root in roots:
+            for path in list_files(root):
+                st = os.stat(path)
+                old = previous_files.get(path)
+                if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                    files[path] = old
+                else:
+                    files[path] = [st.st_size, st.st_mtime_ns, None]
+                    to_hash.append(path)
+        manifest["stages"][stage] = {"roots": roots, "files": files}
+
+    hashes = hash_files(to_hash, algorithm)
+    for stage in manifest["stages"].values():
+        for path, entry in stage["files"].items():
+            if entry[2] is None:
+                entry[2] = hashes.get(path)
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_path, manifest_path)
+
+
+def move_manifest_entries(source_path: str, moves: Dict[str, str], manifest_path: str = MANIFEST_PATH):
+    """
+    Move the entries of files that were renamed into place from the manifest written for them where they were (e.g.
+    a prepared update's) into the install manifest, so write_manifest() doesn't hash them again. Renames keep the
+    files' mtimes, so the moved entries still match. Does nothing if either manifest is missing or they use different
+    hash algorithms.
+    :param source_path: manifest written by write_manifest() for the files before they were moved
+    :param moves: dict of each moved file/directory to where it was moved
+    :param manifest_path: the install manifest to move the entries into
+    """
+    source, manifest = load_manifest(source_path), load_manifest(manifest_path)
+    if source is None or manifest is None or source["algorithm"] != manifest["algorithm"]:
+        return
+
+    def move(path: str) -> str:
+        for old_root, new_root in moves.items():
+            if path == old_root or path.startswith(old_root + os.sep):
+                return new_root + path[len(old_root):]
+        return path
+
+    for stage, info in source["stages"].items():
+        manifest["stages"][stage] = {"roots": [move(root) for root in info["roots"]],
+                                     "files": {move(path): entry for path, entry in info["files"].items()}}
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_path, manifest_path)
+
+
+def verify_install(deep: bool = False, manifest_path: str = MANIFEST_PATH,
+                   stages: Optional[Iterable[str]] = None) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Check the installed files against the manifest. Files whose size and mtime are unchanged are assumed to be
+    intact unless deep is set; all others are re-hashed in parallel.
+    :param deep: re-hash every file
+    :param manifest_path: manifest written by write_manifest()
+    :param stages: only check the files of these stages (default: all)
+    :return: dict of stage name to a list of (path, problem) for the stages that have problems
+    """
+    manifest = load_manifest(manifest_path)
+    if manifest is None:
+        raise FileNotFoundError(f"No install manifest found at {manifest_path}; run the installer first")
+    algorithm = manifest["algorithm"]
+
+    problems: Dict[str, List[Tuple[str, str]]] = {}
+    to_hash = {}
+    for stage, info in manifest["stages"].items():
+        if stages is not None and stage not in stages:
+            continue
+        for path, (size, mtime_ns, digest) in info["files"].items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                problems.setdefault(stage, []).append((path, "missing"))
+                continue
+            if st.st_size != size:
+                problems.setdefault(stage, []).append((path, "size changed"))
+            elif deep or st.st_mtime_ns != mtime_ns:
+                to_hash[path] = (stage, digest)
+
+    hashes = hash_files(list(to_hash), algorithm)
+    for path, (stage, digest) in to_hash.items():
+        if hashes[path] is None:
+            problems.setdefault(stage, []).append((path, "unreadable"))
+        elif hashes[path] != digest:
+            problems.setdefault(stage, []).append((path, "contents changed"))
+    return problems
@@ -0,0 +1,176 @@
+"""
+Functions for the launch wrapper that the mod's Steam shortcut runs (see launch.py).
+
+Before the mod starts, the wrapper stats a fixed handful of files recorded at install time (Cemu's settings.xml, the
+graphics pack directories and the mod's user.config files). Only if one of them changed does it look closer and repair
+what drifted; the other modules are only imported then, so an unchanged install launches without a noticeable delay.
+
+The shortcut runs a copy of the wrapper installed in WORKING_DIR with the system's python3, so the mod keeps launching
+if the installer's directory or the Python it was run with is removed. The wrapper and the modules it uses therefore
+only use the standard library.
+"""
+
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List, Optional
+
+from utils.common import WORKING_DIR
+
+LAUNCH_STATE_PATH = os.path.join(WORKING_DIR, "launch_state.json")
+LAUNCHER_DIR = os.path.join(WORKING_DIR, "launcher")  # the installed copy of the wrapper
+LAUNCHER_PATH = os.path.join(LAUNCHER_DIR, "launch.py")
+LAUNCHER_INTERPRETER = "/usr/bin/env python3"
+# the wrapper and every module it imports, relative to the installer's directory
+LAUNCHER_FILES = ["launch.py", "utils/__init__.py", "utils/answers.py", "utils/common.py", "utils/integrity.py",
+                  "utils/launcher.py", "utils/mod_settings.py"]
+
+
+def install_launcher():
+    """
+    Copy the launch wrapper into LAUNCHER_DIR, replacing each file atomically in case the mod is being launched.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for file in LAUNCHER_FILES:
+        destination = os.path.join(LAUNCHER_DIR, file)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(os.path.join(repo_dir, file), destination + ".tmp")
+        os.replace(destination + ".tmp", destination)
+
+
+def add_launcher_to_options(launch_options: str) -> str:
+    """
+    Insert the installed launch wrapper in front of %command% in a shortcut's launch options, keeping the user's own
+    options (e.g. `gamemoderun %command%` or environment variables). Options without %command% are arguments that
+    Steam appends to the command, so they stay after it.
+    :return: the new launch options (unchanged if they already run the wrapper)
+    """
+    import re
+
+    if LAUNCHER_PATH in launch_options:
+        return launch_options
+    # earlier versions ran the wrapper from the installer's directory
+    launch_options = re.sub(r"\"[^\"]*\" \"[^\"]*launch\.py\" (?=%command%)", "", launch_options)
+    wrapper = f"{LAUNCHER_INTERPRETER} \"{LAUNCHER_PATH}\" %command%"
+    if "%command%" in launch_options:
+        return launch_options.replace("%command%", wrapper, 1)
+    return f"{wrapper} {launch_options}".strip()
+
+
+def get_launch_options() -> str:
+    """
+    Get the launch options for a new Steam shortcut, which run the mod through the installed launch wrapper.
+    """
+    return add_launcher_to_options("")
+
+
+def get_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_pack_paths(state: Dict) -> List[str]:
+    """
+    Get the placed graphics pack directories and their rules.txt files. A directory's mtime changes when files are
+    added to or removed from it directly, and Cemu ignores a pack without rules.txt.
+    """
+    return state["pack_roots"] + [os.path.join(root, "rules.txt") for root in state["pack_roots"]]
+
+
+def get_watched_paths(state: Dict) -> List[str]:
+    return [state["settings_path"]] + get_pack_paths(state) + state["user_configs"]
+
+
+def record_launch_state(cemu_dir: str, pack_path: str, pack_roots: List[str], user_configs: List[str]):
+    """
+    Record the files the launch wrapper checks, with their current mtimes.
+    :param cemu_dir: the Cemu directory
+    :param pack_path: the generated graphics pack, to repair the placed packs from
+    :param pack_roots: where the graphics packs are placed in the Cemu directory
+    :param user_configs: the mod's user.config files
+    """
+    state = {"cemu_dir": cemu_dir, "pack_path": pack_path, "settings_path": os.path.join(cemu_dir, "settings.xml"),
+             "pack_roots": pack_roots, "user_configs": user_configs}
+    state["mtimes"] = {path: get_mtime(path) for path in get_watched_paths(state)}
+    tmp_path = LAUNCH_STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(tmp_path, LAUNCH_STATE_PATH)
+
+
+def repair_graphics_packs(cemu_dir: str, pack_path: str):
+    """
+    Copy back the placed graphics pack files that are missing or changed according to the install manifest, or copy
+    all of them back if the manifest can't be checked.
+    """
+    from utils.integrity import verify_install
+    from utils.mod_settings import get_graphics_pack_destinations
+
+    destination, patches_destination = get_graphics_pack_destinations(cemu_dir)
+    try:
+        problems = verify_install(stages=["place"]).get("place", [])
+    except (FileNotFoundError, ImportError):  # no manifest, or it was hashed with xxhash, which isn't installed here
+        shutil.copytree(pack_path, destination, dirs_exist_ok=True)
+        shutil.copytree(os.path.join(pack_path, "patches"), patches_destination, dirs_exist_ok=True)
+        print("Copied the graphics packs back.")
+        return
+    for path, _ in problems:
+        if path.startswith(patches_destination + os.sep):
+            source = os.path.join(pack_path, "patches", os.path.relpath(path, patches_destination))
+        else:
+            source = os.path.join(pack_path, os.path.relpath(path, destination))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy2(source, path)
+    if problems:
+        print(f"Repaired {len(problems)} graphics pack file(s).")
+
+
+def check_and_repair() -> bool:
+    """
+    Check the recorded install state and repair what drifted.
+    :return: whether anything had to be checked more closely
+    """
+    if not os.path.exists(LAUNCH_STATE_PATH):
+        return False
+    with open(LAUNCH_STATE_PATH, "r") as state_file:
+        state = json.load(state_file)
+    changed = [path for path in get_watched_paths(state) if get_mtime(path) != state["mtimes"].get(path)]
+    if not changed:
+        return False
+
+    # the other modules are only needed once something has changed
+    from utils.mod_settings import get_setting_json_location, get_win_settings_json_location, \
+        set_setting_json_location, update_graphics_packs
+
+    if any(path in changed for path in get_pack_paths(state)):
+        repair_graphics_packs(state["cemu_dir"], state["pack_path"])
+    # Cemu rewrites settings.xml whenever it exits, so this usually finds the entries still there
+    if state["settings_path"] in changed and update_graphics_packs(state["cemu_dir"]):
+        print("Re-added the mod's graphics packs to Cemu's settings.")
+    settings_json_location = get_win_settings_json_location()
+    for config_file in state["user_configs"]:
+        if config_file in changed and os.path.exists(config_file) \
+                and get_setting_json_location(config_file) != settings_json_location:
+            set_setting_json_location(config_file, settings_json_location)
+            print(f"Pointed {config_file} back to the installer's settings.")
+
+    record_launch_state(state["cemu_dir"], state["pack_path"], state["pack_roots"], state["user_configs"])
+    return True
+
+
+def launch(command: List[str]):
+    """
+    Check the install, then replace this process with the mod's launch command (Steam's %command%).
+    """
+    if len(command) == 0:
+        print("Usage: launch.py <command to run the mod>", file=sys.stderr)
+        exit(2)
+    try:
+        check_and_repair()
+    except Exception as e:  # a failed check shouldn't stop the mod from starting
+        print(f"Failed to check the mod's install. Error: {e}", file=sys.stderr)
+    sys.stdout.flush()  # exec discards anything still buffered
+    os.execvp(command[0], command)
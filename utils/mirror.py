@@ -0,0 +1,102 @@
+"""
+Functions for snapshotting the mod's latest release (and Cemu) into a directory, and serving it over HTTP on the LAN,
+so that many devices can be set up while only downloading from the internet once.
+
+Mirror layout (URLs are relative to the mirror's base URL):
+    releases.json      - the GitHub releases JSON, as returned by DOWNLOAD_URL
+    assets/<name>      - the assets of the latest release
+    cemu/<name>        - the Cemu zip from CEMU_URL
+"""
+
+import functools
+import json
+import os
+import sys
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from utils.common import CEMU_URL, DOWNLOAD_URL
+
+
+def download_file(url: str, destination: str, expected_size: int = None):
+    """
+    Download a file, unless it is already there (with the expected size, if given).
+    :param url: URL to download from
+    :param destination: path to download to
+    :param expected_size: size the file should have, if known
+    """
+    if os.path.exists(destination) and (expected_size is None or os.path.getsize(destination) == expected_size):
+        print(f"{os.path.basename(destination)} already in mirror, skipping.")
+        return
+    import requests
+
+    print(f"Downloading {url}...")
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        # download to a temporary file first so a half-downloaded file is never served
+        with open(destination + ".tmp", "wb") as tmp_file:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                tmp_file.write(chunk)
+    os.replace(destination + ".tmp", destination)
+
+
+def snapshot_mirror(mirror_dir: str, include_cemu: bool = True):
+    """
+    Snapshot the mod's releases JSON and the latest release's assets (and optionally Cemu) into a mirror directory.
+    Files that are already in the mirror are not downloaded again.
+    :param mirror_dir: directory to snapshot into
+    :param include_cemu: whether to also mirror the Cemu zip
+    """
+    import requests
+
+    r = requests.get(DOWNLOAD_URL)
+    r_json = r.json()
+    if r.status_code != 200 or not isinstance(r_json, list) or len(r_json) == 0:
+        message = r_json.get("message", "") if isinstance(r_json, dict) else ""
+        raise RuntimeError(f"Unexpected response from {DOWNLOAD_URL} ({r.status_code}) {message}")
+
+    latest_release = r_json[0]
+    print(f"Mirroring BOTWM mod version {latest_release['tag_name']}")
+    for asset in latest_release["assets"]:
+        asset_name = os.path.basename(urlparse(asset["browser_download_url"]).path)
+        download_file(asset["browser_download_url"], os.path.join(mirror_dir, "assets", asset_name),
+                      asset.get("size"))
+
+    if include_cemu:
+        download_file(CEMU_URL, os.path.join(mirror_dir, "cemu", os.path.basename(urlparse(CEMU_URL).path)))
+
+    # write the releases JSON last, so the mirror only advertises a release once its assets are in place
+    with open(os.path.join(mirror_dir, "releases.json.tmp"), "w") as releases_file:
+        json.dump(r_json, releases_file)
+    os.replace(os.path.join(mirror_dir, "releases.json.tmp"), os.path.join(mirror_dir, "releases.json"))
+
+
+def create_mirror_server(mirror_dir: str, host: str = "0.0.0.0", port: int = 8000) -> ThreadingHTTPServer:
+    """
+    Create (but don't start) an HTTP server for a mirror directory.
+    :param mirror_dir: directory created by snapshot_mirror()
+    :param host: address to listen on
+    :param port: port to listen on (0 picks a free port)
+    :return: the server; call serve_forever() on it to start serving
+    """
+    if not os.path.exists(os.path.join(mirror_dir, "releases.json")):
+        raise FileNotFoundError(f"{mirror_dir} is not a mirror directory (no releases.json); snapshot it first")
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=os.path.abspath(mirror_dir))
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve_mirror(mirror_dir: str, host: str = "0.0.0.0", port: int = 8000):
+    """
+    Serve a mirror directory over HTTP until interrupted with ctrl+C.
+    """
+    server = create_mirror_server(mirror_dir, host, port)
+    print(f"Serving {mirror_dir} on port {server.server_address[1]}. Run the installer on other devices with "
+          f"--mirror http://<this device's IP>:{server.server_address[1]}")
+    print("Press ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Mirror stopped.", file=sys.stderr)
+    finally:
+        server.server_close()
@@ -0,0 +1,94 @@
+"""
+Functions for the settings that point Cemu and the mod at the installed files.
+
+These only use the standard library, so that the launch wrapper installed next to the mod (see utils.launcher) can
+repair them without the installer's dependencies.
+"""
+
+import os
+from typing import Optional, Tuple
+from xml.etree import ElementTree as ET
+
+from utils.common import WORKING_DIR
+
+# graphics packs that need to be enabled in Cemu's settings.xml
+GRAPHIC_PACK_ENTRIES = [
+    {"filename": "graphicPacks/BreathOfTheWild_BCML/rules.txt"},
+    {"filename": "graphicPacks/bcmlPatches/BreathoftheWildMultiplayer/rules.txt"},
+    {"filename": "graphicPacks/downloadedGraphicPacks/BreathOfTheWild/Mods/ExtendedMemory/rules.txt"},
+    {"filename": "graphicPacks/downloadedGraphicPacks/BreathOfTheWild/Mods/FPS++/rules.txt"},
+]
+
+
+def get_graphics_pack_destinations(cemu_path: str) -> Tuple[str, str]:
+    """
+    Get where the BCML graphics pack and its patches are placed in the Cemu directory.
+    :return: Tuple (pack_destination, patches_destination)
+    """
+    return (os.path.join(cemu_path, "graphicPacks/BreathOfTheWild_BCML"),
+            os.path.join(cemu_path, "graphicPacks", "bcmlPatches", "BreathoftheWildMultiplayer"))
+
+
+def update_graphics_packs(cemu_path: str) -> bool:
+    """
+    Add the mod's graphics packs to Cemu's settings.xml, if they aren't in it already.
+    :return: whether any entries had to be added
+    """
+    # Add the relevant entries to the settings.xml file
+    settings_path = os.path.join(cemu_path, "settings.xml")
+    tree = ET.parse(settings_path)
+    root = tree.getroot()
+
+    graphic_pack_element = root.find("GraphicPack")
+    added = False
+    for entry in GRAPHIC_PACK_ENTRIES:
+        if not any(e.attrib["filename"] == entry["filename"] for e in graphic_pack_element):
+            entry_element = ET.Element("Entry", entry)
+            graphic_pack_element.append(entry_element)
+            added = True
+    # only rewrite the file if needed, so its mtime only changes when Cemu (or we) actually changed it
+    if added:
+        tree.write(settings_path)
+    return added
+
+
+def get_win_settings_json_location() -> str:
+    """
+    Get the Windows path (inside the prefix) of the settings JSON written by generate_win_settings_json().
+    """
+    setting_json_location = os.path.join(WORKING_DIR, "settings_windows.json")
+    return f"Z:{setting_json_location}".replace("/", "\\")
+
+
+def get_setting_json_location(xml_file_path: str) -> Optional[str]:
+    """
+    Get the settings JSON location (bcmlLocation) the mod's user.config points to, if it has one.
+    """
+    value_element = ET.parse(xml_file_path).getroot().find(
+        ".//userSettings/Breath_of_the_Wild_Multiplayer.Properties.Settings/setting[@name='bcmlLocation']/value")
+    return value_element.text if value_element is not None else None
+
+
+def set_setting_json_location(xml_file_path: str, settings_json_location: str):
+    # Parse the XML file
+    tree = ET.parse(xml_file_path)
+    root = tree.getroot()
+
+    # Get the 'userSettings' element and its 'Breath_of_the_Wild_Multiplayer.Properties.Settings' child
+    user_settings = root.find('.//userSettings/Breath_of_the_Wild_Multiplayer.Properties.Settings')
+
+    # Try to find the 'bcmlLocation' setting
+    bcml_location_setting = user_settings.find(".//setting[@name='bcmlLocation']")
+
+    # If the 'bcmlLocation' setting is not found, create and add it
+    if bcml_location_setting is None:
+        bcml_location_setting = ET.SubElement(user_settings, 'setting', {'name': 'bcmlLocation', 'serializeAs': 'String'})
+        value_element = ET.SubElement(bcml_location_setting, 'value')
+        value_element.text = settings_json_location
+    else:
+        # If the 'bcmlLocation' setting is found, update its value
+        value_element = bcml_location_setting.find('value')
+        value_element.text = settings_json_location
+
+    # Save the changes back to the XML file
+    tree.write(xml_file_path, encoding='utf-8', xml_declaration=True)
@@ -11,23 +11,25 @@ import time
 import uuid
 import zipfile
 from pathlib import Path
-from typing import Optional
-from xml.etree import ElementTree as ET
+from typing import List, Optional
 
-import py7zr
-import requests
-from bcml.install import export, install_mod, refresh_merges
 from packaging import version
-from requests.structures import CaseInsensitiveDict
 
 from utils import appids
-from utils.common import DOWNLOAD_URL, MOD_DIR, STEAM_DIR, WORKING_DIR, terminate_program, wait_for_confirmation, \
-    wait_for_file
+from utils.common import MOD_DIR, STEAM_DIR, WORKING_DIR, ManualStepRequired, get_asset_url, get_download_url, \
+    terminate_program, wait_for_confirmation, wait_for_file
+from utils.mod_settings import get_graphics_pack_destinations, get_win_settings_json_location, \
+    set_setting_json_location
+from utils.priority import get_copy_function
 from utils.steam import run_steam_game
+from utils.tracing import span
 
+SETTINGS_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "settings_template.json")
 
-def get_mod_version() -> Optional[version.Version]:
-    version_path = os.path.join(MOD_DIR, "Version.txt")
+
+def get_mod_version(mod_dir: str = MOD_DIR) -> Optional[version.Version]:
+    version_path = os.path.join(mod_dir, "Version.txt")
     if not os.path.exists(version_path):
         return None
     with open(version_path, "r") as version_file:
@@ -35,15 +37,30 @@ def get_mod_version() -> Optional[version.Version]:
         return version.parse(version_str)
 
 
-def download_mod_files():
+def should_check_for_updates() -> bool:
+    cur_version = get_mod_version()
+    if cur_version is None:
+        return True
+    return wait_for_confirmation(f"BOTWM mod version {cur_version} already downloaded. "
+                                 f"Would you like to check for updates? [Y/n]: ", "check_for_updates", True)
+
+
+def download_mod_files(check_for_updates: bool = True, force: bool = False):
+    """
+    Download the latest mod files, unless that version is already downloaded.
+    :param check_for_updates: whether to check for a newer version if the mod is already downloaded
+    :param force: download and extract the latest version again even if it is already downloaded (e.g. to repair
+    damaged mod files)
+    """
     cur_version = get_mod_version()
-    if cur_version is not None:
-        confirmation = wait_for_confirmation(f"BOTWM mod version {cur_version} already downloaded. "
-                                             f"Would you like to check for updates? [Y/n]: ")
-        if not confirmation:
-            return
+    if cur_version is not None and not check_for_updates and not force:
+        return
+    # imported here rather than at the top so that commands which don't download anything start quickly
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
     headers = CaseInsensitiveDict()
-    r = requests.get(DOWNLOAD_URL, headers=headers)
+    r = requests.get(get_download_url(), headers=headers)
 
     r_json = r.json()
     # if the response doesn't look right, throw an error
@@ -63,35 +80,14 @@ def download_mod_files():
 
     latest_release = r_json[0]
     latest_version = version.parse(latest_release["tag_name"])
-    if cur_version is not None and cur_version == latest_version:
+    if cur_version is not None and cur_version == latest_version and not force:
         print(f"Latest version BOTWM mod ({latest_version}) already downloaded")
         return
     if cur_version is not None and cur_version > latest_version:
         print(f"Current version of BOTWM mod ({cur_version}) is newer than latest version ({latest_version})")
         return
     print(f"Downloading BOTWM mod version {latest_version}")
-    download_link = latest_release["assets"][0]["browser_download_url"]
-
-    r = requests.get(download_link, headers=headers)
-
-    zip_name = os.path.join(WORKING_DIR, uuid.uuid4().hex + ".zip")
-
-    if r.status_code == 200:
-        with open(zip_name, "wb") as zip_file:
-            zip_file.write(r.content)
-
-        with zipfile.ZipFile(zip_name, "r") as zip_ref:
-            zip_ref.extractall(MOD_DIR)
-
-        zip_file.close()
-        zip_ref.close()
-
-        os.remove(zip_name)
-
-        # update version data
-        with open(os.path.join(MOD_DIR, "Version.txt"), "w") as version_file:
-            version_file.write(str(latest_version))
-    else:
+    if not download_release(latest_release, MOD_DIR):
         print("Error downloading mod files!", file=sys.stderr)
         if cur_version is None:
             print("No version of BOTWM mod downloaded! Exiting installer...", file=sys.stderr)
@@ -101,14 +97,52 @@ def download_mod_files():
         return
 
 
-def generate_graphics_packs(game_dir: str, update_dir: str, dlc_dir: str):
-    with open("settings_template.json", "r") as template_file:
+def download_release(release: dict, mod_dir: str) -> bool:
+    """
+    Download a release's mod files and extract them into mod_dir, recording the release's version in it.
+    :param release: the release, as returned by the releases API
+    :param mod_dir: directory to extract the mod files into
+    :return: False if the download failed
+    """
+    import requests
+
+    with span("download_mod"):
+        r = requests.get(get_asset_url(release["assets"][0]["browser_download_url"]))
+    if r.status_code != 200:
+        return False
+
+    zip_name = os.path.join(WORKING_DIR, uuid.uuid4().hex + ".zip")
+    with open(zip_name, "wb") as zip_file:
+        zip_file.write(r.content)
+    with zipfile.ZipFile(zip_name, "r") as zip_ref:
+        zip_ref.extractall(mod_dir)
+    os.remove(zip_name)
+
+    # update version data
+    with open(os.path.join(mod_dir, "Version.txt"), "w") as version_file:
+        version_file.write(str(version.parse(release["tag_name"])))
+    return True
+
+
+def generate_graphics_packs(game_dir: str, update_dir: str, dlc_dir: str, mod_dir: str = MOD_DIR,
+                            output_dir: str = WORKING_DIR) -> str:
+    """
+    Merge the mod with BCML and export the result as a Cemu graphics pack.
+    :param mod_dir: directory with the mod files to merge
+    :param output_dir: directory to export the graphics pack (and the intermediate 7z) into
+    :return: path of the graphics pack
+    """
+    # BCML pulls in a large dependency tree, so only import it once we actually merge
+    import py7zr
+    from bcml.install import export, install_mod, refresh_merges
+
+    with open(SETTINGS_TEMPLATE_PATH, "r") as template_file:
         settings_json = json.load(template_file)
     settings_json["game_dir"] = game_dir
     settings_json["dlc_dir"] = dlc_dir
     settings_json["update_dir"] = update_dir
     settings_json["store_dir"] = os.path.expanduser("~/.config/bcml")
-    settings_json["export_dir"] = os.path.join(WORKING_DIR, "bcml_exports")
+    settings_json["export_dir"] = os.path.join(output_dir, "bcml_exports")
 
     temp_bcml_dir = os.path.expanduser(f"~/.config/bcml_temp_{int(time.time())}")
     bcml_dir = os.path.expanduser("~/.config/bcml")
@@ -124,16 +158,22 @@ def generate_graphics_packs(game_dir: str, update_dir: str, dlc_dir: str):
     with open(os.path.join(bcml_dir, "settings.json"), "w") as settings_file:
         json.dump(settings_json, settings_file, indent=4)
 
-    install_mod(Path(MOD_DIR) / "BNPs" / "BreathoftheWildMultiplayer.bnp")
-    refresh_merges()
-    install_mod(Path(MOD_DIR) / "BNPs" / "BOTWMultiplayer-Classic.bnp")
-    refresh_merges()
-
-    export_path = Path(WORKING_DIR) / "exported-mods.7z"
-    export(export_path, True)
-    graphics_pack = os.path.join(WORKING_DIR, "BreathOfTheWild_BCML")
-    py7zr.unpack_7zarchive(export_path, graphics_pack)
-    rules = Path(WORKING_DIR) / "BreathOfTheWild_BCML" / "rules.txt"
+    with span("install_mod"):
+        install_mod(Path(mod_dir) / "BNPs" / "BreathoftheWildMultiplayer.bnp")
+    with span("refresh_merges"):
+        refresh_merges()
+    with span("install_mod"):
+        install_mod(Path(mod_dir) / "BNPs" / "BOTWMultiplayer-Classic.bnp")
+    with span("refresh_merges"):
+        refresh_merges()
+
+    export_path = Path(output_dir) / "exported-mods.7z"
+    with span("export"):
+        export(export_path, True)
+    graphics_pack = os.path.join(output_dir, "BreathOfTheWild_BCML")
+    with span("unpack_export"):
+        py7zr.unpack_7zarchive(export_path, graphics_pack)
+    rules = Path(graphics_pack) / "rules.txt"
     rules.write_text(
         "[Definition]\n"
         "titleIds = 00050000101C9300,00050000101C9400,00050000101C9500\n"
@@ -148,46 +188,28 @@ def generate_graphics_packs(game_dir: str, update_dir: str, dlc_dir: str):
 
     shutil.rmtree(bcml_dir)
 
-    shutil.move(temp_bcml_dir, bcml_dir)
+    # restore the user's own BCML settings, if they had any
+    if os.path.exists(temp_bcml_dir):
+        shutil.move(temp_bcml_dir, bcml_dir)
 
     return graphics_pack
 
 
 def place_graphics_packs(cemu_path: str, bcml_path: str):
-    destination = os.path.join(cemu_path, "graphicPacks/BreathOfTheWild_BCML")
+    destination, patches_destination = get_graphics_pack_destinations(cemu_path)
     if os.path.exists(destination):
         shutil.rmtree(destination)
-    shutil.copytree(bcml_path, destination)
+    with span("copytree"):
+        shutil.copytree(bcml_path, destination, copy_function=get_copy_function())
     patches = os.path.join(bcml_path, "patches")
-    patches_destination = os.path.join(cemu_path, "graphicPacks", "bcmlPatches", "BreathoftheWildMultiplayer")
     if os.path.exists(patches_destination):
         shutil.rmtree(patches_destination)
-    shutil.copytree(patches, patches_destination)
-
-
-def update_graphics_packs(cemu_path: str):
-    # Add the relevant entries to the settings.xml file
-    settings_path = os.path.join(cemu_path, "settings.xml")
-    tree = ET.parse(settings_path)
-    root = tree.getroot()
-
-    graphic_pack_entries = [
-        {"filename": "graphicPacks/BreathOfTheWild_BCML/rules.txt"},
-        {"filename": "graphicPacks/bcmlPatches/BreathoftheWildMultiplayer/rules.txt"},
-        {"filename": "graphicPacks/downloadedGraphicPacks/BreathOfTheWild/Mods/ExtendedMemory/rules.txt"},
-        {"filename": "graphicPacks/downloadedGraphicPacks/BreathOfTheWild/Mods/FPS++/rules.txt"},
-    ]
-
-    graphic_pack_element = root.find("GraphicPack")
-    for entry in graphic_pack_entries:
-        if not any(e.attrib["filename"] == entry["filename"] for e in graphic_pack_element):
-            entry_element = ET.Element("Entry", entry)
-            graphic_pack_element.append(entry_element)
-    tree.write(settings_path)
+    with span("copytree"):
+        shutil.copytree(patches, patches_destination, copy_function=get_copy_function())
 
 
 def generate_win_settings_json(cemu_dir: str, game_dir: str, update_dir: str, dlc_dir: str):
-    with open("settings_template.json", "r") as template_file:
+    with open(SETTINGS_TEMPLATE_PATH, "r") as template_file:
         settings_json = json.load(template_file)
     # the mod is ok with forward slashes I'm pretty sure
     settings_json["game_dir"] = f"Z:{game_dir}"
@@ -198,36 +220,29 @@ def generate_win_settings_json(cemu_dir: str, game_dir: str, update_dir: str, dl
         json.dump(settings_json, settings_file, indent=4)
 
 
-def set_setting_json_location(xml_file_path: str, settings_json_location: str):
-    # Parse the XML file
-    tree = ET.parse(xml_file_path)
-    root = tree.getroot()
+def get_mod_appdata_path(prefix_app_id: int) -> str:
+    return os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/pfx/drive_c/users/steamuser/AppData/Local/",
+                        f"Breath_of_the_Wild_Multip")
 
-    # Get the 'userSettings' element and its 'Breath_of_the_Wild_Multiplayer.Properties.Settings' child
-    user_settings = root.find('.//userSettings/Breath_of_the_Wild_Multiplayer.Properties.Settings')
 
-    # Try to find the 'bcmlLocation' setting
-    bcml_location_setting = user_settings.find(".//setting[@name='bcmlLocation']")
-
-    # If the 'bcmlLocation' setting is not found, create and add it
-    if bcml_location_setting is None:
-        bcml_location_setting = ET.SubElement(user_settings, 'setting', {'name': 'bcmlLocation', 'serializeAs': 'String'})
-        value_element = ET.SubElement(bcml_location_setting, 'value')
-        value_element.text = settings_json_location
-    else:
-        # If the 'bcmlLocation' setting is found, update its value
-        value_element = bcml_location_setting.find('value')
-        value_element.text = settings_json_location
+def get_user_config_paths(prefix_app_id: int) -> List[str]:
+    """
+    Get the mod's user.config files in the given prefix.
+    """
+    mod_appdata_path = get_mod_appdata_path(prefix_app_id)
+    if not os.path.exists(mod_appdata_path):
+        return []
+    all_subdirs = os.listdir(mod_appdata_path)
 
-    # Save the changes back to the XML file
-    tree.write(xml_file_path, encoding='utf-8', xml_declaration=True)
+    # Filter the list to include only folders that start with "Breath_of_the_Wild_Multi"
+    return [os.path.join(mod_appdata_path, item, "1.0.0.0/user.config") for item in all_subdirs if
+            os.path.exists(os.path.join(mod_appdata_path, item, "1.0.0.0/user.config"))
+            and item.startswith("Breath_of_the_Wild_Multi")]
 
 
 def update_user_config(cemu_dir: str, game_dir: str, update_dir: str, dlc_dir: str, prefix_app_id: int):
     generate_win_settings_json(cemu_dir, game_dir, update_dir, dlc_dir)
-    mod_appdata_path = os.path.join(STEAM_DIR,
-                                    f"steamapps/compatdata/{prefix_app_id}/pfx/drive_c/users/steamuser/AppData/Local/",
-                                    f"Breath_of_the_Wild_Multip")
+    mod_appdata_path = get_mod_appdata_path(prefix_app_id)
     if not os.path.exists(mod_appdata_path):
         print("Need to generate a config file for the mod! Opening the mod...")
         try:
@@ -237,29 +252,16 @@ def update_user_config(cemu_dir: str, game_dir: str, update_dir: str, dlc_dir: s
             time.sleep(3)  # make sure the config file is created
             terminate_program("Breath of the Wild Multiplayer.exe")
         except (subprocess.CalledProcessError, TimeoutError) as e:
-            print(f"Failed to launch the BOTWM shortcut. Error: {e}", file=sys.stderr)
-            print(
+            raise ManualStepRequired(
+                f"Failed to launch the BOTWM shortcut. Error: {e}\n"
                 f"Please manually open Steam, and open the \"Breath of the Wild Multiplayer\" shortcut to generate the "
-                f"mod's config files. Once it has opened successfully, please close it, and press enter to continue.",
-                file=sys.stderr)
-            print("Press enter to continue...", file=sys.stderr, end="")
-            input()
-            if not os.path.exists(mod_appdata_path):
-                print("Config files still not found! Please contact the authors of this installer.", file=sys.stderr)
-                exit(1)
+                f"mod's config files. Once it has opened successfully, please close it.")
 
-    all_subdirs = os.listdir(mod_appdata_path)
-
-    # Filter the list to include only folders that start with "Breath_of_the_Wild_Multi"
-    config_files = [os.path.join(mod_appdata_path, item, "1.0.0.0/user.config") for item in all_subdirs if
-                    os.path.exists(os.path.join(mod_appdata_path, item, "1.0.0.0/user.config"))
-                    and item.startswith("Breath_of_the_Wild_Multi")]
+    config_files = get_user_config_paths(prefix_app_id)
     if len(config_files) == 0:
         print("No config files found! Please manually open the mod, and close it to generate the config files,"
               "then rerun the installer.")
         exit(1)
 
     for config_file in config_files:
-        setting_json_location = os.path.join(WORKING_DIR, "settings_windows.json")
-        win_settings_json_path = f"Z:{setting_json_location}".replace("/", "\\")
-        set_setting_json_location(config_file, win_settings_json_path)
+        set_setting_json_location(config_file, get_win_settings_json_location())
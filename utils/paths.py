@@ -3,10 +3,12 @@ Path utilities.
 """
 
 import os
+import sys
 from typing import Tuple, Optional, Dict, List
 from xml.etree import ElementTree as ET
 
-from utils.common import wait_for_confirmation
+from utils.answers import get_answer, is_unattended
+from utils.common import EXIT_INVALID_ANSWER, exit_answer_required, wait_for_confirmation
 
 
 def normalize_path(path: str) -> str:
@@ -92,6 +94,8 @@ def get_path(input_message: str, **kwargs) -> str:
     required_files: list = kwargs.get("required_files", [])
     required_sub_files: dict = kwargs.get("required_sub_files", {})
 
+    if is_unattended():
+        exit_answer_required(input_message)
     while True:
         user_input = input(input_message)
         is_valid, reason, normalized_path = check_path(
@@ -106,6 +110,24 @@ def get_path(input_message: str, **kwargs) -> str:
             print(f"Invalid Path: {reason}")
 
 
+def get_answered_path(answer_key: str, **kwargs) -> Optional[str]:
+    """
+    Get a path from the answers (see utils.answers), validated like check_path.
+    Exits the installer if the answered path is invalid.
+    :param answer_key: key of the answer holding the path
+    :param kwargs: requirements, as for check_path
+    :return: The normalized path, or None if the path wasn't answered.
+    """
+    answer = get_answer(answer_key)
+    if answer is None:
+        return None
+    is_valid, reason, path = check_path(answer, **kwargs)
+    if not is_valid:
+        print(f"Invalid path given for {answer_key}: {reason}", file=sys.stderr)
+        exit(EXIT_INVALID_ANSWER)
+    return path
+
+
 def get_sd_path() -> Optional[str]:
     """
     Get the path to the SD card
@@ -121,7 +143,8 @@ def get_directory(xml_root: Optional[ET.Element],
                   base_dir: str,
                   sub_folders: Dict[str, List[str]],
                   path_contains: Optional[List[str]],
-                  prompt_type: str) -> str:
+                  prompt_type: str,
+                  answer_key: str = None) -> str:
     """
     Get the directory for the specified type (game, update, or DLC) of Breath of the Wild.
     The function checks the XML file, the default installed directory, and prompts the user if needed.
@@ -132,8 +155,14 @@ def get_directory(xml_root: Optional[ET.Element],
     :param sub_folders: A dictionary of required sub-folders and their files to validate the directory.
     :param path_contains: A list of substrings that are required to be in the file path (optional).
     :param prompt_type: The type of directory being searched for (e.g., "Game", "Update", "DLC").
+    :param answer_key: Key of the answer holding the directory, if any (see utils.answers).
     :return: The valid file path entered by the user or found in the XML or default directory.
     """
+    if answer_key is not None:
+        answered_dir = get_answered_path(answer_key, path_contains=path_contains, sub_folder_includes=sub_folders)
+        if answered_dir is not None:
+            return answered_dir
+
     if xml_root is not None:
         for title in xml_root.findall(f".//title[@titleId='{title_id}']"):
             xml_dir = normalize_path(title.find("path").text)
@@ -142,14 +171,16 @@ def get_directory(xml_root: Optional[ET.Element],
             is_valid, reason, xml_dir = check_path(xml_dir, path_contains=path_contains,
                                                    sub_folder_includes=sub_folders)
             if is_valid:
-                confirmation = wait_for_confirmation(f"Is this your BOTW {prompt_type} dir?\n{xml_dir}\n[Y/n]: ")
+                confirmation = wait_for_confirmation(f"Is this your BOTW {prompt_type} dir?\n{xml_dir}\n[Y/n]: ",
+                                                     default=True)
                 if confirmation:
                     return xml_dir
 
     is_valid, reason, installed_dir = check_path(installed_dir, path_contains=path_contains,
                                                  sub_folder_includes=sub_folders)
     if is_valid:
-        confirmation = wait_for_confirmation(f"Is this your BOTW {prompt_type} dir?\n{installed_dir}\n[Y/n]: ")
+        confirmation = wait_for_confirmation(f"Is this your BOTW {prompt_type} dir?\n{installed_dir}\n[Y/n]: ",
+                                             default=True)
         if confirmation:
             return installed_dir
 
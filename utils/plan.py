@@ -0,0 +1,264 @@
+"""
+Functions for planning an install without changing anything: which stages would run, which files they would modify,
+and roughly how many bytes and how much time they would cost.
+"""
+
+import glob
+import json
+import os
+import statistics
+import sys
+from typing import Any, Dict, List, Optional
+from xml.etree import ElementTree as ET
+
+from utils import appids
+from utils.common import MOD_DIR, STATE_PATH, STEAM_DIR, WORKING_DIR, get_download_url
+from utils.dumps import DLC_TITLE_ID, GAME_TITLE_ID, UPDATE_TITLE_ID, get_reference_path
+from utils.launcher import add_launcher_to_options
+from utils.mod_settings import GRAPHIC_PACK_ENTRIES, get_graphics_pack_destinations, get_setting_json_location, \
+    get_win_settings_json_location
+from utils.multiplayer_mod import get_mod_version, get_user_config_paths
+from utils.stages import Stage, load_state, plan_stages
+from utils.steam import GRIDS_DIR, SHORTCUT_NAME, find_shortcut, get_dotnet_paths, get_grid_files
+from utils.tracing import LOG_DIR
+
+
+def get_stage_times(runs: int = 5) -> Dict[str, float]:
+    """
+    Get the median time each stage took when it actually ran, over the last few run logs (see utils.tracing).
+    """
+    times: Dict[str, List[float]] = {}
+    for path in sorted(glob.glob(os.path.join(LOG_DIR, "run-*.jsonl")))[-runs:]:
+        try:
+            with open(path, "r") as log_file:
+                for line in log_file:
+                    record = json.loads(line)
+                    if record.get("event") == "span" and record.get("stage") and record.get("error") is None:
+                        times.setdefault(record["name"], []).append(record["wall_s"])
+        except (OSError, ValueError):
+            continue
+    return {name: statistics.median(wall_times) for name, wall_times in times.items()}
+
+
+def get_latest_release() -> Optional[Dict[str, Any]]:
+    import requests
+
+    try:
+        r = requests.get(get_download_url(), timeout=30)
+        r.raise_for_status()
+        releases = r.json()
+        return releases[0] if isinstance(releases, list) and len(releases) > 0 else None
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not check for mod updates. Error: {e}", file=sys.stderr)
+        return None
+
+
+def plan_download(check_for_updates: bool, offline: bool, force: bool = False) -> Dict[str, Any]:
+    from packaging import version
+
+    cur_version = get_mod_version()
+    step = {"run": False, "reason": f"version {cur_version} is downloaded", "modifies": [],
+            "result": str(cur_version)}
+    if cur_version is not None and not check_for_updates and not force:
+        return step
+    if offline:
+        step.update(run=cur_version is None, reason="not checking for updates (offline)")
+        return step
+    latest_release = get_latest_release()
+    if latest_release is None:
+        step.update(run=cur_version is None, reason="could not check for updates")
+        return step
+    latest_version = version.parse(latest_release["tag_name"])
+    if cur_version is not None and (latest_version < cur_version or (latest_version == cur_version and not force)):
+        step["reason"] = f"version {cur_version} is the latest"
+        return step
+    reason = f"download version {latest_version} again (forced)" if latest_version == cur_version else \
+        f"new version {latest_version} (downloaded: {cur_version})"
+    step.update(run=True, reason=reason, modifies=[MOD_DIR],
+                result=str(latest_version), download_bytes=latest_release["assets"][0].get("size"))
+    return step
+
+
+def plan_shortcut(user_ids: List[str]) -> Dict[str, Any]:
+    import vdf
+
+    modifies, missing = [os.path.join(STEAM_DIR, "config", "config.vdf")], []
+    for user_id in user_ids:
+        shortcuts_path = os.path.join(STEAM_DIR, f"userdata/{user_id}/config/shortcuts.vdf")
+        shortcut = None
+        if os.path.exists(shortcuts_path):
+            with open(shortcuts_path, "rb") as shortcuts_file:
+                shortcut = find_shortcut(vdf.binary_load(shortcuts_file))
+        if shortcut is None:
+            missing.append(user_id)
+        if shortcut is None or \
+                add_launcher_to_options(shortcut.get("LaunchOptions", "")) != shortcut.get("LaunchOptions", ""):
+            modifies.append(shortcuts_path)
+    reason = f"add the shortcut for user(s) {', '.join(missing)}" if missing else "update the shortcut"
+    return {"reason": reason + "; closes Steam", "modifies": modifies}
+
+
+def plan_grids(prefix_app_ids: Dict[str, int]) -> Dict[str, Any]:
+    modifies, write_bytes = [], 0
+    for user_id, app_id in prefix_app_ids.items():
+        grid_dir = os.path.join(STEAM_DIR, f"userdata/{user_id}/config/grid")
+        for file in get_grid_files():
+            destination = os.path.join(grid_dir, file.replace("BotWM", str(app_id)))
+            if not os.path.exists(destination):
+                modifies.append(destination)
+                write_bytes += os.path.getsize(os.path.join(GRIDS_DIR, file))
+    return {"reason": f"copy {len(modifies)} artwork file(s)", "modifies": modifies, "write_bytes": write_bytes}
+
+
+def plan_prefix(prefix_app_ids: List[int], reinstall: bool = False) -> Dict[str, Any]:
+    reasons = []
+    for prefix_app_id in prefix_app_ids:
+        if reinstall and os.path.exists(os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/version")):
+            reasons.append(f"reinstall .NET into prefix {prefix_app_id}")
+        elif not os.path.exists(os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/version")):
+            reasons.append(f"create prefix {prefix_app_id} (launches the mod) and install .NET")
+        elif not all(os.path.exists(path) for path in get_dotnet_paths(prefix_app_id)):
+            reasons.append(f"install .NET into prefix {prefix_app_id}")
+        else:
+            reasons.append(f"check .NET in prefix {prefix_app_id}")
+    return {"reason": "; ".join(reasons) or "no prefix yet",
+            "modifies": [os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}")
+                         for prefix_app_id in prefix_app_ids]}
+
+
+def plan_dumps(deep: bool) -> Dict[str, Any]:
+    read_bytes, missing = 0, []
+    for title_id in [GAME_TITLE_ID, UPDATE_TITLE_ID, DLC_TITLE_ID]:
+        reference_path = get_reference_path(title_id)
+        if not os.path.exists(reference_path):
+            missing.append(title_id)
+        elif deep:
+            with open(reference_path, "r") as reference_file:
+                read_bytes += json.load(reference_file).get("total_size", 0)
+    reason = "validate the dumps" + (f" (no reference manifest for {', '.join(missing)})" if missing else "")
+    return {"reason": reason, "modifies": [], "read_bytes": read_bytes}
+
+
+def plan_generate(pack_path: Optional[str]) -> Dict[str, Any]:
+    pack_path = pack_path or os.path.join(WORKING_DIR, "BreathOfTheWild_BCML")
+    return {"reason": "merge the mod with BCML", "modifies": [os.path.expanduser("~/.config/bcml"), pack_path]}
+
+
+def plan_place(cemu_dir: str, pack_path: Optional[str]) -> Dict[str, Any]:
+    """
+    place_graphics_packs() deletes and recopies both packs, so it writes the whole pack plus its patches again; the
+    number of files that actually differ is reported alongside.
+    """
+    destinations = get_graphics_pack_destinations(cemu_dir)
+    if pack_path is None or not os.path.exists(pack_path):
+        return {"reason": "copy the graphics packs", "modifies": list(destinations)}
+    write_bytes, changed = 0, 0
+    for source_root, destination_root in [(pack_path, destinations[0]),
+                                          (os.path.join(pack_path, "patches"), destinations[1])]:
+        for dir_path, _, files in os.walk(source_root):
+            for file in files:
+                source = os.path.join(dir_path, file)
+                st = os.stat(source)
+                write_bytes += st.st_size
+                try:
+                    dest_st = os.stat(os.path.join(destination_root, os.path.relpath(source, source_root)))
+                    if dest_st.st_size != st.st_size or dest_st.st_mtime_ns != st.st_mtime_ns:
+                        changed += 1
+                except OSError:
+                    changed += 1
+    return {"reason": f"recopy the graphics packs ({changed} file(s) differ)", "modifies": list(destinations),
+            "write_bytes": write_bytes}
+
+
+def plan_settings(cemu_dir: str) -> Dict[str, Any]:
+    settings_path = os.path.join(cemu_dir, "settings.xml")
+    if not os.path.exists(settings_path):
+        return {"run": True, "reason": "settings.xml is missing (start Cemu once to create it)", "modifies": []}
+    graphic_pack_element = ET.parse(settings_path).getroot().find("GraphicPack")
+    entries = {e.attrib.get("filename") for e in graphic_pack_element} if graphic_pack_element is not None else set()
+    missing = [entry["filename"] for entry in GRAPHIC_PACK_ENTRIES if entry["filename"] not in entries]
+    if not missing:
+        return {"run": False, "reason": "graphics packs are enabled", "modifies": []}
+    return {"run": True, "reason": f"enable {len(missing)} graphics pack(s)", "modifies": [settings_path]}
+
+
+def plan_config(prefix_app_ids: List[int]) -> Dict[str, Any]:
+    modifies = [os.path.join(WORKING_DIR, "settings_windows.json")]
+    for prefix_app_id in prefix_app_ids:
+        for config_file in get_user_config_paths(prefix_app_id):
+            if get_setting_json_location(config_file) != get_win_settings_json_location():
+                modifies.append(config_file)
+    return {"reason": "point the mod to the installer's settings", "modifies": modifies}
+
+
+def make_plan(stages: List[Stage], cemu_dir: str, user_ids: List[str], check_for_updates: bool,
+              force: List[str] = (), deep_dump_check: bool = False, offline: bool = False) -> List[Dict[str, Any]]:
+    """
+    Work out what an install would do, without changing anything.
+    :param stages: the install stages, as built by main.build_stages()
+    :param force: stages that would be forced to run
+    :param offline: don't check the releases endpoint for a new mod version
+    :return: one dict per stage, with whether it would run, why, the files it would modify, and its estimated
+    download/read/write bytes and time
+    """
+    download = plan_download(check_for_updates, offline, "download" in force)
+    would_run = plan_stages(stages, STATE_PATH, force, {"download": download.pop("result")})
+    state = load_state(STATE_PATH)
+    shortcut_result = (state.get("shortcut") or {}).get("result") or {}
+    if not shortcut_result:
+        # no shortcut recorded yet, so work out the prefix the shortcut stage would create
+        mod_exe = f"\"{os.path.join(MOD_DIR, 'Breath of the Wild Multiplayer.exe')}\""
+        prefix_app_id = appids.shortcut_id_to_short_app_id(appids.generate_shortcut_id(mod_exe, SHORTCUT_NAME))
+        shortcut_result = {user_id: prefix_app_id for user_id in user_ids}
+    prefix_app_ids = sorted(set(shortcut_result.values()))
+    pack_path = (state.get("generate") or {}).get("result")
+
+    details = {
+        "download": lambda: download,
+        "shortcut": lambda: plan_shortcut(user_ids),
+        "grids": lambda: plan_grids(shortcut_result),
+        "prefix": lambda: plan_prefix(prefix_app_ids, "prefix" in force),
+        "dumps": lambda: plan_dumps(deep_dump_check),
+        "generate": lambda: plan_generate(pack_path),
+        "place": lambda: plan_place(cemu_dir, pack_path),
+        "settings": lambda: plan_settings(cemu_dir),
+        "config": lambda: plan_config(prefix_app_ids),
+    }
+    stage_times = get_stage_times()
+    plan = []
+    for name, run in would_run.items():
+        step = {"stage": name, "run": run, "reason": "up to date", "modifies": []}
+        # the download and settings stages always run, but are no-ops when there is nothing to change
+        if run or name in ("download", "settings"):
+            step.update(details[name]())
+        if step["run"]:
+            step["estimated_s"] = stage_times.get(name)
+        plan.append(step)
+    return plan
+
+
+def print_plan(plan: List[Dict[str, Any]]):
+    def mb(num_bytes: Optional[int]) -> str:
+        return f"{num_bytes / 1024 / 1024:10.1f}" if num_bytes else f"{'-':>10}"
+
+    print(f"{'stage':<10}{'action':<8}{'est. s':>8}{'down MB':>10}{'read MB':>10}{'write MB':>10}  reason")
+    for step in plan:
+        estimate = step.get("estimated_s")
+        print(f"{step['stage']:<10}{'run' if step['run'] else 'skip':<8}"
+              f"{f'{estimate:.1f}' if estimate is not None else '-':>8}{mb(step.get('download_bytes'))}"
+              f"{mb(step.get('read_bytes'))}{mb(step.get('write_bytes'))}  {step['reason']}")
+
+    running = [step for step in plan if step["run"]]
+    if not running:
+        print("\nNothing to do: the install is up to date.")
+        return
+    print("\nWould modify:")
+    for step in running:
+        for path in step["modifies"]:
+            print(f"  [{step['stage']}] {path}")
+    known_time = sum(step.get("estimated_s") or 0 for step in running)
+    unknown = [step["stage"] for step in running if step.get("estimated_s") is None]
+    print(f"\nEstimated time: {known_time:.0f} s" + (f" plus {', '.join(unknown)} (no previous runs)" if unknown
+                                                    else ""))
+    print(f"Estimated download: {sum(step.get('download_bytes') or 0 for step in running) / 1024 / 1024:.1f} MB, "
+          f"write: {sum(step.get('write_bytes') or 0 for step in running) / 1024 / 1024:.1f} MB")
@@ -0,0 +1,325 @@
+"""
+Functions for preparing mod updates in the background, so applying them later is a near-instant swap.
+
+A systemd user timer runs `main.py prebuild`, which polls the releases endpoint with a conditional request (so an
+unchanged release list costs one small request and doesn't count against GitHub's rate limit). When a new release is
+out, the mod is downloaded and merged into a staging directory at idle priority, and the graphics packs are copied
+next to the Cemu directory. `main.py apply-update` then swaps the staged directories into place with renames.
+"""
+
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from utils.common import MOD_DIR, WORKING_DIR, get_download_url
+from utils.integrity import move_manifest_entries, write_manifest
+from utils.priority import get_copy_function
+from utils.mod_settings import get_graphics_pack_destinations
+from utils.multiplayer_mod import download_release, generate_graphics_packs, get_mod_version
+
+STAGING_DIR = os.path.join(WORKING_DIR, "staging")
+PREBUILD_STATE_PATH = os.path.join(WORKING_DIR, "prebuild_state.json")
+LOCK_PATH = os.path.join(WORKING_DIR, "install.lock")  # held by the installer and the prebuild, so they never overlap
+CEMU_STAGING_NAME = ".botwm_staging"  # staged graphics packs, in the Cemu directory so they can be renamed into place
+
+SERVICE_NAME = "botwm-prebuild"
+SYSTEMD_DIR = os.path.expanduser("~/.config/systemd/user")
+
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+
+@contextlib.contextmanager
+def install_lock(wait: bool = True):
+    """
+    Hold the install lock.
+    :param wait: wait for the lock if it is held (otherwise raise BlockingIOError)
+    """
+    os.makedirs(WORKING_DIR, exist_ok=True)
+    with open(LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not wait:
+                raise
+            print("Waiting for another install or background update to finish...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_prebuild_state() -> Dict[str, Any]:
+    if not os.path.exists(PREBUILD_STATE_PATH):
+        return {}
+    try:
+        with open(PREBUILD_STATE_PATH, "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_prebuild_state(state: Dict[str, Any]):
+    with open(PREBUILD_STATE_PATH + ".tmp", "w") as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(PREBUILD_STATE_PATH + ".tmp", PREBUILD_STATE_PATH)
+
+
+def is_newer_than_installed(staged: Dict[str, Any]) -> bool:
+    from packaging import version
+
+    cur_version = get_mod_version()
+    return cur_version is None or version.parse(staged["version"]) > cur_version
+
+
+def get_staged_update() -> Optional[Dict[str, Any]]:
+    """
+    Get the prepared update, if there is one that is newer than the installed mod.
+    """
+    staged = load_prebuild_state().get("staged")
+    if staged is None or not os.path.exists(staged["mod_dir"]) or not is_newer_than_installed(staged):
+        return None
+    return staged
+
+
+def poll_latest_release(state: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Optional[str]]]:
+    """
+    Get the latest release, sending the validators saved in state so an unchanged release list is answered with a
+    bodyless 304.
+    :return: Tuple (latest_release, validators); latest_release is None if the release list is unchanged. The
+    validators should only be saved once the release has been handled, so a failed prebuild is retried.
+    """
+    import requests
+
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    r = requests.get(get_download_url(), headers=headers, timeout=30)
+    if r.status_code == 304:
+        return None, {}
+    r.raise_for_status()
+    releases = r.json()
+    if not isinstance(releases, list) or len(releases) == 0:
+        raise ValueError("unexpected response from the releases endpoint")
+    return releases[0], {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+
+def get_installed_dirs(install_state: Dict[str, Dict]) -> Optional[Dict[str, str]]:
+    """
+    Get the Cemu and dump directories of the completed install from the stage-state manifest.
+    :return: dict with cemu_dir, game_dir, update_dir and dlc_dir, or None if the packs were never placed
+    """
+    generate, place = install_state.get("generate", {}), install_state.get("place", {})
+    if not generate.get("completed") or not place.get("completed"):
+        return None
+    return dict(generate["inputs"], cemu_dir=place["inputs"]["cemu_dir"])
+
+
+def remove_staging(staged: Dict[str, Any]):
+    for path in [staged["staging_dir"], staged["cemu_staging_dir"]]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_outdated_staging(state: Dict[str, Any]):
+    """
+    Delete the prepared update if the installed mod has caught up with it (e.g. the installer was run since), as the
+    staged files can take up several GB. Must be called with the install lock held.
+    :param state: the prebuild state, which is updated and saved if the update is removed
+    """
+    staged = state.get("staged")
+    if staged is None or is_newer_than_installed(staged):
+        return
+    print(f"Removing the prepared update to version {staged['version']}, which is already installed.")
+    remove_staging(staged)
+    state.pop("staged")
+    save_prebuild_state(state)
+
+
+def prebuild(install_state: Dict[str, Dict]) -> Optional[str]:
+    """
+    Prepare the latest release if it is newer than the installed (and any already prepared) version.
+    Must be called with the install lock held.
+    :param install_state: the installer's stage-state manifest
+    :return: the version that was prepared, or None if there was nothing to do
+    """
+    from packaging import version
+
+    dirs = get_installed_dirs(install_state)
+    if dirs is None:
+        print("The mod hasn't been installed yet, nothing to update.")
+        return None
+
+    state = load_prebuild_state()
+    remove_outdated_staging(state)
+    latest_release, validators = poll_latest_release(state)
+    if latest_release is None:
+        print("No new release since the last check.")
+        return None
+    latest_version = version.parse(latest_release["tag_name"])
+    cur_version = get_mod_version()
+    staged = state.get("staged")
+    if (cur_version is not None and latest_version <= cur_version) or \
+            (staged is not None and staged["version"] == str(latest_version)):
+        print(f"BOTWM mod version {latest_version} is already installed or prepared.")
+        state.update(validators)
+        save_prebuild_state(state)
+        return None
+
+    if staged is not None:
+        remove_staging(staged)
+        state.pop("staged")
+        save_prebuild_state(state)
+
+    print(f"Preparing BOTWM mod version {latest_version}...")
+    staging_dir = os.path.join(STAGING_DIR, str(latest_version))
+    cemu_staging_dir = os.path.join(dirs["cemu_dir"], CEMU_STAGING_NAME)
+    staged = {"version": str(latest_version), "staging_dir": staging_dir, "cemu_staging_dir": cemu_staging_dir,
+              "mod_dir": os.path.join(staging_dir, "mod"), "dirs": dirs}
+    remove_staging(staged)
+    os.makedirs(staging_dir)
+    if not download_release(latest_release, staged["mod_dir"]):
+        raise RuntimeError("failed to download the release")
+    staged["pack_dir"] = generate_graphics_packs(dirs["game_dir"], dirs["update_dir"], dirs["dlc_dir"],
+                                                 staged["mod_dir"], staging_dir)
+    # stage the packs on the Cemu directory's filesystem, so they can be renamed into place
+    staged["pack_destinations"] = [os.path.join(cemu_staging_dir, "pack"), os.path.join(cemu_staging_dir, "patches")]
+    shutil.copytree(staged["pack_dir"], staged["pack_destinations"][0], copy_function=get_copy_function())
+    shutil.copytree(os.path.join(staged["pack_dir"], "patches"), staged["pack_destinations"][1],
+                    copy_function=get_copy_function())
+    # hash the staged files now, at idle priority, so applying the update doesn't have to
+    staged["manifest_path"] = os.path.join(staging_dir, "install_manifest.json")
+    write_manifest({"download": [staged["mod_dir"]], "generate": [staged["pack_dir"]],
+                    "place": staged["pack_destinations"]}, staged["manifest_path"])
+
+    state["staged"] = staged
+    state.update(validators)
+    save_prebuild_state(state)
+    print(f"BOTWM mod version {latest_version} is ready. Run `main.py apply-update` to install it.")
+    return str(latest_version)
+
+
+def exchange_paths(path_a: str, path_b: str):
+    """
+    Atomically swap two paths on the same filesystem with renameat2(RENAME_EXCHANGE), falling back to two renames
+    (with a short window where path_b doesn't exist) where that isn't supported.
+    """
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    renameat2 = getattr(libc, "renameat2", None)
+    if renameat2 is not None:
+        if renameat2(AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b), RENAME_EXCHANGE) == 0:
+            return
+        error = ctypes.get_errno()
+        if error not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise OSError(error, os.strerror(error), path_a, None, path_b)
+    tmp_path = path_a + ".swap"
+    os.rename(path_b, tmp_path)
+    os.rename(path_a, path_b)
+    os.rename(tmp_path, path_a)
+
+
+def swap_into_place(new_path: str, path: str):
+    """
+    Move new_path to path. Whatever was at path is left at new_path.
+    """
+    if os.path.exists(path):
+        exchange_paths(new_path, path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.rename(new_path, path)
+
+
+def apply_staged_update(staged: Dict[str, Any], pack_path: str):
+    """
+    Swap the prepared mod files and graphics packs into place, along with their install manifest entries, then
+    delete the old ones. Must be called with the install lock held.
+    :param staged: the prepared update, as returned by get_staged_update()
+    :param pack_path: where the installer keeps the generated graphics pack (the generate stage's result)
+    """
+    moves = {staged["mod_dir"]: MOD_DIR, staged["pack_dir"]: pack_path}
+    moves.update(zip(staged["pack_destinations"], get_graphics_pack_destinations(staged["dirs"]["cemu_dir"])))
+    for new_path, path in moves.items():
+        swap_into_place(new_path, path)
+    if "manifest_path" in staged:  # (not there for updates prepared by older versions of the installer)
+        move_manifest_entries(staged["manifest_path"], moves)
+    remove_staging(staged)
+    state = load_prebuild_state()
+    state.pop("staged", None)
+    save_prebuild_state(state)
+
+
+def escape_systemd_specifiers(value: str) -> str:
+    """
+    Escape a value for a systemd unit setting that expands specifiers (%h, %u, ...), so it is taken literally.
+    """
+    return value.replace("%", "%%")
+
+
+def quote_systemd_arg(arg: str) -> str:
+    """
+    Quote a command line argument for a systemd ExecStart= setting, which is split on whitespace, unescapes \\ and
+    \" inside quotes and expands specifiers and $VARIABLES.
+    """
+    escaped = arg.replace("\\", "\\\\").replace('"', '\\"').replace("$", "$$")
+    return f'"{escape_systemd_specifiers(escaped)}"'
+
+
+def install_service(repo_dir: str, interval: str, mirror_url: Optional[str] = None):
+    """
+    Install and start a systemd user timer that runs the prebuild periodically at idle priority.
+    :param repo_dir: directory of the installer's main.py
+    :param interval: time between polls, as a systemd time span (e.g. "6h")
+    :param mirror_url: LAN mirror to poll instead of GitHub, if any
+    """
+    command = [sys.executable, os.path.join(repo_dir, "main.py")]
+    if mirror_url is not None:
+        command += ["--mirror", mirror_url]
+    command.append("prebuild")
+    os.makedirs(SYSTEMD_DIR, exist_ok=True)
+    with open(os.path.join(SYSTEMD_DIR, f"{SERVICE_NAME}.service"), "w") as service_file:
+        service_file.write(
+            "[Unit]\n"
+            "Description=Prepare Breath of the Wild Multiplayer mod updates\n"
+            "Wants=network-online.target\n"
+            "After=network-online.target\n"
+            "\n"
+            "[Service]\n"
+            "Type=oneshot\n"
+            # (WorkingDirectory= takes the rest of the line as the path, so it is only unquoted and not split)
+            f"WorkingDirectory={escape_systemd_specifiers(repo_dir)}\n"
+            f"ExecStart={' '.join(quote_systemd_arg(arg) for arg in command)}\n"
+            "Nice=19\n"
+            "CPUSchedulingPolicy=idle\n"
+            "IOSchedulingClass=idle\n")
+    with open(os.path.join(SYSTEMD_DIR, f"{SERVICE_NAME}.timer"), "w") as timer_file:
+        timer_file.write(
+            "[Unit]\n"
+            "Description=Check for Breath of the Wild Multiplayer mod updates\n"
+            "\n"
+            "[Timer]\n"
+            "OnBootSec=10min\n"
+            f"OnUnitActiveSec={interval}\n"
+            "RandomizedDelaySec=10min\n"
+            "\n"
+            "[Install]\n"
+            "WantedBy=timers.target\n")
+    subprocess.run(["systemctl", "--user", "daemon-reload"], check=True)
+    subprocess.run(["systemctl", "--user", "enable", "--now", f"{SERVICE_NAME}.timer"], check=True)
+
+
+def uninstall_service():
+    subprocess.run(["systemctl", "--user", "disable", "--now", f"{SERVICE_NAME}.timer"], check=False)
+    for unit in [f"{SERVICE_NAME}.service", f"{SERVICE_NAME}.timer"]:
+        if os.path.exists(os.path.join(SYSTEMD_DIR, unit)):
+            os.remove(os.path.join(SYSTEMD_DIR, unit))
+    subprocess.run(["systemctl", "--user", "daemon-reload"], check=False)
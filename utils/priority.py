@@ -0,0 +1,145 @@
+"""
+Functions for running the installer in the background without making a running game or Steam stutter.
+
+The CPU niceness and the idle I/O scheduling class are inherited by every subprocess the installer starts (protontricks,
+flatpak, wine), so they cover the whole install. The optional cgroup v2 weights are applied by re-running the installer
+in a systemd scope; flatpak moves the apps it runs into a scope of their own, so those only keep the niceness and I/O
+class. Large copies can also be rate limited, and the time spent waiting for the rate limit is counted so the run
+report can show what it cost.
+"""
+
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "i386": 289}
+
+SCOPE_ENV = "BOTWM_IN_SCOPE"  # set once the installer has been re-run in its own systemd scope
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, shared between threads. Callers may go into debt and then wait it off, so a chunk
+    larger than the bucket still gets through.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: float) -> float:
+        """
+        Take amount tokens, sleeping until the bucket has refilled enough.
+        :return: seconds spent waiting
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_copy_bucket: Optional[TokenBucket] = None
+_throttle_lock = threading.Lock()
+_throttle_stats = {"wait_s": 0.0, "bytes": 0}
+
+
+def set_io_priority_idle() -> bool:
+    """
+    Put this process (and so every process it starts) in the idle I/O scheduling class with ioprio_set().
+    :return: False if that isn't supported here
+    """
+    import ctypes
+
+    syscall_number = SYS_IOPRIO_SET.get(platform.machine())
+    if syscall_number is None:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    return libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+
+
+def lower_priority():
+    """
+    Run at the lowest CPU priority and in the idle I/O class.
+    """
+    os.nice(19 - os.nice(0))
+    if not set_io_priority_idle():
+        print("Could not set the idle I/O priority, continuing with only a lower CPU priority.", file=sys.stderr)
+
+
+def run_in_cgroup(weight: int):
+    """
+    Re-run the installer in a transient systemd scope with the given cgroup v2 CPU and I/O weight (1-10000, the
+    default is 100), unless it is already running in one. Does nothing if systemd isn't available.
+    """
+    if os.environ.get(SCOPE_ENV) == "1":
+        return
+    if shutil.which("systemd-run") is None or \
+            subprocess.run(["systemctl", "--user", "show-environment"], capture_output=True).returncode != 0:
+        print("systemd isn't available, not setting cgroup weights.", file=sys.stderr)
+        return
+    os.environ[SCOPE_ENV] = "1"
+    os.execvp("systemd-run", ["systemd-run", "--user", "--scope", "--quiet", "-p", f"CPUWeight={weight}",
+                              "-p", f"IOWeight={weight}", "--", sys.executable] + sys.argv)
+
+
+def set_copy_rate(bytes_per_second: Optional[float]):
+    """
+    Limit the copies made with get_copy_function() to the given rate (None removes the limit).
+    """
+    global _copy_bucket
+    _copy_bucket = TokenBucket(bytes_per_second) if bytes_per_second else None
+
+
+def get_throttle_stats() -> Dict[str, float]:
+    """
+    Get the total time spent waiting for the copy rate limit, and the bytes copied under it.
+    """
+    with _throttle_lock:
+        return dict(_throttle_stats)
+
+
+def throttled_copy(src: str, dst: str, *, follow_symlinks: bool = True) -> str:
+    """
+    Copy a file like shutil.copy2, in chunks that are each let through by the copy rate limit.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    waited = 0.0
+    copied = 0
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        while True:
+            chunk = src_file.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            waited += _copy_bucket.consume(len(chunk))
+            dst_file.write(chunk)
+            copied += len(chunk)
+    shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    with _throttle_lock:
+        _throttle_stats["wait_s"] += waited
+        _throttle_stats["bytes"] += copied
+    return dst
+
+
+def get_copy_function() -> Callable:
+    """
+    Get the copy function for shutil.copytree: rate limited if a copy rate is set, shutil.copy2 otherwise.
+    """
+    return throttled_copy if _copy_bucket is not None else shutil.copy2
@@ -0,0 +1,225 @@
+"""
+Functions for running the installer as a dependency graph of stages.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# `func` takes a dict of the results of the stages run so far (keyed by stage name) and returns this stage's result,
+# which must be JSON serializable so it can be checkpointed.
+# `deps` are the names of the stages that must finish before this one starts.
+# `inputs` takes the same dict and returns the (JSON serializable) inputs of the stage; if they and the results of its
+# dependencies are unchanged since the stage last completed, the stage is skipped. None means the stage always runs.
+# `check` takes the same dict (including this stage's recorded result) and returns whether the stage's output is still
+# in place, so that a stage whose output was deleted is run again even if its inputs are unchanged.
+Stage = collections.namedtuple("Stage", ["name", "func", "deps", "inputs", "check"], defaults=[(), None, None])
+
+
+def validate_stages(stages: List[Stage]):
+    """
+    Check that every dependency exists and that the stages don't form a cycle.
+    :param stages: stages to check
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    visiting, visited = set(), set()
+
+    def visit(name: str):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage '{name}' is part of a dependency cycle")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+
+def get_dependents(stages: List[Stage], names: Iterable[str]) -> Set[str]:
+    """
+    Get the given stages and every stage that (transitively) depends on them.
+    """
+    dependents = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name not in dependents and any(dep in dependents for dep in stage.deps):
+                dependents.add(stage.name)
+                changed = True
+    return dependents
+
+
+def load_state(state_path: str) -> Dict[str, Dict]:
+    """
+    Load the stage-state manifest, which maps each stage name to its inputs, inputs fingerprint, result and
+    completion.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        print("Install state file is unreadable, running all stages.", file=sys.stderr)
+        return {}
+
+
+def save_state(state_path: str, state: Dict[str, Dict]):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file, indent=4, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def fingerprint_stage(stage: Stage, inputs: Any, results: Dict[str, Any],
+                      fingerprints: Dict[str, Optional[str]]) -> Optional[str]:
+    """
+    Hash a stage's inputs together with the fingerprints and results of its dependencies.
+    :return: hex digest, or None if the stage has no inputs function (i.e. always runs)
+    """
+    if stage.inputs is None:
+        return None
+    data = {
+        "inputs": inputs,
+        "deps": {dep: [fingerprints.get(dep), results.get(dep)] for dep in stage.deps},
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def is_up_to_date(stage: Stage, record: Optional[Dict], fingerprint: Optional[str], forced: Set[str],
+                  results: Dict[str, Any]) -> bool:
+    """
+    Check whether a stage can be skipped: it isn't forced, it last completed with the same fingerprint, and its check
+    (if any) still passes.
+    :param record: the stage's record in the stage-state manifest, if any
+    :param results: the results of the stages before it
+    """
+    if stage.name in forced or fingerprint is None or record is None:
+        return False
+    if not record.get("completed") or record.get("fingerprint") != fingerprint:
+        return False
+    return stage.check is None or stage.check(dict(results, **{stage.name: record.get("result")}))
+
+
+def plan_stages(stages: List[Stage], state_path: str, force: Iterable[str] = (),
+                predicted: Optional[Dict[str, Any]] = None) -> Dict[str, bool]:
+    """
+    Work out which stages run_stages() would run, without running any of them. A stage that would run is assumed to
+    return predicted[name] if given, and otherwise the same result as last time.
+    :param stages: stages to plan
+    :param state_path: path of the stage-state manifest
+    :param force: names of stages to run even if they are up to date
+    :param predicted: predicted results of stages that would run
+    :return: dict of stage name to whether it would run, in the order the stages would start
+    """
+    validate_stages(stages)
+    unknown = set(force) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+    forced = get_dependents(stages, force)
+    predicted = predicted or {}
+
+    state = load_state(state_path)
+    results: Dict[str, Any] = {}
+    fingerprints: Dict[str, Optional[str]] = {}
+    would_run: Dict[str, bool] = {}
+    pending = list(stages)
+    while pending:
+        stage = next(s for s in pending if all(dep in results for dep in s.deps))
+        pending.remove(stage)
+        record = state.get(stage.name)
+        try:
+            inputs = stage.inputs(results) if stage.inputs is not None else None
+            fingerprints[stage.name] = fingerprint_stage(stage, inputs, results, fingerprints)
+            would_run[stage.name] = not is_up_to_date(stage, record, fingerprints[stage.name], forced, results)
+        except (KeyError, TypeError, AttributeError):  # a dependency has never completed, so has no result
+            fingerprints[stage.name] = None
+            would_run[stage.name] = True
+        recorded = record.get("result") if record is not None else None
+        results[stage.name] = predicted.get(stage.name, recorded) if would_run[stage.name] else recorded
+    return would_run
+
+
+def run_stages(stages: List[Stage], max_workers: int = 4, state_path: Optional[str] = None,
+               force: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Run the stages, starting each one as soon as all of its dependencies have finished, so independent stages run
+    concurrently. If a stage fails, no new stages are started, the running ones are allowed to finish, and the
+    failure is re-raised.
+    If a state path is given, each stage's fingerprint and result are recorded there as it completes, and stages that
+    already completed with the same fingerprint (and whose check still passes) are skipped on later runs.
+    :param stages: stages to run
+    :param max_workers: maximum number of stages to run at once
+    :param state_path: path of the stage-state manifest (None disables checkpointing)
+    :param force: names of stages to run even if they are up to date (their dependents are run too)
+    :return: dict of stage name to stage result
+    """
+    # imported here so that commands which only read the state (e.g. status) start quickly
+    from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+    validate_stages(stages)
+    unknown = set(force) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+    forced = get_dependents(stages, force)
+
+    state = load_state(state_path) if state_path is not None else {}
+    results: Dict[str, Any] = {}
+    fingerprints: Dict[str, Optional[str]] = {}
+    inputs: Dict[str, Any] = {}
+    pending = list(stages)
+    running: Dict[Future, Stage] = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [s for s in pending if all(dep in results for dep in s.deps)] if error is None else []
+            while ready:
+                stage = ready.pop(0)
+                pending.remove(stage)
+                inputs[stage.name] = stage.inputs(results) if stage.inputs is not None else None
+                fingerprints[stage.name] = fingerprint_stage(stage, inputs[stage.name], results, fingerprints)
+                if is_up_to_date(stage, state.get(stage.name), fingerprints[stage.name], forced, results):
+                    print(f"Skipping stage '{stage.name}' (already done, inputs unchanged).")
+                    results[stage.name] = state[stage.name].get("result")
+                    # skipping may have unblocked more stages
+                    ready = [s for s in pending if all(dep in results for dep in s.deps)]
+                    continue
+                running[executor.submit(stage.func, dict(results))] = stage
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                    state[stage.name] = {"fingerprint": fingerprints[stage.name], "inputs": inputs[stage.name],
+                                         "result": results[stage.name], "completed": True}
+                except BaseException as e:  # stages may call exit(), which raises SystemExit
+                    state[stage.name] = {"fingerprint": fingerprints[stage.name], "inputs": inputs[stage.name],
+                                         "completed": False}
+                    if error is None:
+                        error = e
+                if state_path is not None:
+                    save_state(state_path, state)
+
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,77 @@
+"""
+Functions for quickly reporting the state of an install, without running (or importing) any of the heavy stages.
+"""
+
+import os
+from typing import Any, Dict
+from xml.etree import ElementTree as ET
+
+from utils.common import MOD_DIR, STATE_PATH, STEAM_DIR
+from utils.mod_settings import GRAPHIC_PACK_ENTRIES, get_graphics_pack_destinations
+from utils.stages import load_state
+from utils.steam import get_dotnet_paths, get_shortcut_app_id
+
+
+def get_status() -> Dict[str, Any]:
+    """
+    Collect the state of the install from the stage-state manifest and a few file checks.
+    :return: dict with the mod version, the stages that completed, and the shortcut, prefix and pack state
+    """
+    state = load_state(STATE_PATH)
+    status: Dict[str, Any] = {"mod_version": None, "stages": {}, "shortcuts": {}, "prefixes": {}, "packs": None}
+
+    version_path = os.path.join(MOD_DIR, "Version.txt")
+    if os.path.exists(version_path):
+        with open(version_path, "r") as version_file:
+            status["mod_version"] = version_file.read().strip()
+
+    status["stages"] = {name: bool(record.get("completed")) for name, record in state.items()}
+
+    shortcut_result = state.get("shortcut", {}).get("result") or {}
+    for user_id in shortcut_result:
+        status["shortcuts"][user_id] = get_shortcut_app_id(user_id) is not None
+
+    for prefix_app_id in sorted(set(shortcut_result.values())):
+        prefix_dir = os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}")
+        status["prefixes"][prefix_app_id] = {
+            "created": os.path.exists(os.path.join(prefix_dir, "version")),
+            "dotnet": all(os.path.exists(path) for path in get_dotnet_paths(prefix_app_id)),
+        }
+
+    cemu_dir = (state.get("place", {}).get("inputs") or {}).get("cemu_dir")
+    if cemu_dir is not None:
+        settings_path = os.path.join(cemu_dir, "settings.xml")
+        entries = set()
+        if os.path.exists(settings_path):
+            graphic_pack_element = ET.parse(settings_path).getroot().find("GraphicPack")
+            if graphic_pack_element is not None:
+                entries = {e.attrib.get("filename") for e in graphic_pack_element}
+        status["packs"] = {
+            "cemu_dir": cemu_dir,
+            "placed": all(os.path.exists(os.path.join(destination, "rules.txt"))
+                          for destination in get_graphics_pack_destinations(cemu_dir)),
+            "in_settings": all(entry["filename"] in entries for entry in GRAPHIC_PACK_ENTRIES),
+        }
+
+    return status
+
+
+def print_status():
+    status = get_status()
+
+    def yes_no(value: bool) -> str:
+        return "yes" if value else "NO"
+
+    print(f"Mod version: {status['mod_version'] or 'not downloaded'}")
+    if status["stages"]:
+        print("Stages: " + ", ".join(f"{name} ({'done' if done else 'FAILED'})"
+                                     for name, done in status["stages"].items()))
+    else:
+        print("Stages: installer has not been run yet")
+    for user_id, present in status["shortcuts"].items():
+        print(f"Shortcut for Steam user {user_id}: {yes_no(present)}")
+    for prefix_app_id, prefix in status["prefixes"].items():
+        print(f"Prefix {prefix_app_id}: created: {yes_no(prefix['created'])}, .NET installed: {yes_no(prefix['dotnet'])}")
+    if status["packs"] is not None:
+        print(f"Graphics packs in {status['packs']['cemu_dir']}: placed: {yes_no(status['packs']['placed'])}, "
+              f"enabled in settings.xml: {yes_no(status['packs']['in_settings'])}")
@@ -8,12 +8,21 @@ import shutil
 import subprocess
 import sys
 import time
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 import vdf
 
 from utils import appids
-from utils.common import MOD_DIR, STEAM_DIR, Shortcut, terminate_program, wait_for_file
+from utils.answers import get_answer, is_unattended
+from utils.common import EXIT_INVALID_ANSWER, MOD_DIR, STEAM_DIR, ManualStepRequired, Shortcut, \
+    exit_answer_required, terminate_program, wait_for_file
+from utils.launcher import add_launcher_to_options, get_launch_options
+from utils.tracing import log_event, span
+from utils.winetricks_cache import get_cached_protontricks_cmd, record_cache, verify_cache
+
+SHORTCUT_NAME = "Breath of the Wild Multiplayer"
+# the shortcut's artwork, shipped with the installer
+GRIDS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "grids")
 
 
 def is_valid_steam_installation(directory: str) -> bool:
@@ -89,16 +98,25 @@ def run_steam_game(prefix_app_id: int):
                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
-def add_dependencies_to_prefix(prefix_app_id: int):
+def get_dotnet_paths(prefix_app_id: int) -> Tuple[str, str]:
     """
-    Adds the dependencies for the Breath of the Wild multiplayer mod to the Steam prefix.
-    :param prefix_app_id: The Steam app ID of the prefix to add the dependencies to.
+    Get the paths of the 32-bit and 64-bit dotnet.exe installed into the mod's prefix by dotnetdesktop6.
     """
-    protontricks_cmd = install_protontricks()
     dotnet_32_path = os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/pfx/drive_c/"
                                              f"Program Files (x86)/dotnet/dotnet.exe")
     dotnet_64_path = os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/pfx/drive_c/"
                                              f"Program Files/dotnet/dotnet.exe")
+    return dotnet_32_path, dotnet_64_path
+
+
+def add_dependencies_to_prefix(prefix_app_id: int, reinstall: bool = False):
+    """
+    Adds the dependencies for the Breath of the Wild multiplayer mod to the Steam prefix.
+    :param prefix_app_id: The Steam app ID of the prefix to add the dependencies to.
+    :param reinstall: Install the dependencies again even if they are already installed (e.g. to repair them).
+    """
+    protontricks_cmd = install_protontricks()
+    dotnet_32_path, dotnet_64_path = get_dotnet_paths(prefix_app_id)
 
     prefix_version_file = os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/version")
     if not os.path.exists(prefix_version_file):
@@ -109,29 +127,21 @@ def add_dependencies_to_prefix(prefix_app_id: int):
         try:
             run_steam_game(prefix_app_id)
         except subprocess.CalledProcessError as e:
-            print(f"Failed to launch the BOTWM shortcut. Error: {e}", file=sys.stderr)
-            print(
-                f"Please manually open Steam, and open the \"Breath of the Wild Multiplayer\" shortcut once to generate"
-                f"necessary files. Once it has closed/you have closed the shortcut, please press enter.",
-                file=sys.stderr)
-            print("Press enter to continue...", file=sys.stderr, end="")
-            input()
+            raise ManualStepRequired(
+                f"Failed to launch the BOTWM shortcut. Error: {e}\n"
+                f"Please manually open Steam, and open the \"Breath of the Wild Multiplayer\" shortcut once to generate "
+                f"necessary files, then close it.")
 
         # wait for the prefix to be created
         if not wait_for_file(os.path.join(STEAM_DIR, f"steamapps/compatdata/{prefix_app_id}/version"), 20):
-            print("Failed to create the Proton prefix for the mod.", file=sys.stderr)
-            print(f"Please manually open Steam, and open the \"Breath of the Wild Multiplayer\" shortcut once to "
-                  f"generate necessary files. Once it has closed/you have closed the shortcut, please press enter.",
-                  file=sys.stderr)
-            print("Press enter to continue...", file=sys.stderr, end="")
-            input()
-            if not os.path.exists(prefix_version_file):
-                print("Prefix still not created! Please contact the installer authors for help.", file=sys.stderr)
-                exit(1)
+            raise ManualStepRequired(
+                f"Failed to create the Proton prefix for the mod.\n"
+                f"Please manually open Steam, and open the \"Breath of the Wild Multiplayer\" shortcut once to generate "
+                f"necessary files, then close it.")
         time.sleep(4)  # Wait a bit longer to make sure the prefix is fully created
         terminate_program("Breath of the Wild Multiplayer.exe")
         print("Proton prefix for the mod created! Installing dependencies...")
-    else:
+    elif not reinstall:
         # proton prefix already exists. let's see if we need dotnetdesktop6
         try:
             # Use capture_output=True to capture stdout
@@ -150,16 +160,23 @@ def add_dependencies_to_prefix(prefix_app_id: int):
             pass
 
         print("Proton prefix for the mod already exists. Installing dependencies...")
+    else:
+        print("Reinstalling the mod's dependencies...")
 
-    # install dependencies
+    # install dependencies, letting winetricks use our verified download cache
+    verify_cache()
+    cached_cmd, cached_env = get_cached_protontricks_cmd(protontricks_cmd)
     try:
-        subprocess.run(protontricks_cmd.split() + [str(prefix_app_id), "-q", "dotnetdesktop6"], check=True)
+        with span("protontricks"):
+            # winetricks skips verbs it thinks are installed unless forced
+            subprocess.run(cached_cmd + [str(prefix_app_id), "-q"] + (["--force"] if reinstall else []) +
+                           ["dotnetdesktop6"], check=True, env=cached_env)
+        record_cache()
     except subprocess.CalledProcessError as e:
-        print(f"Failed to install dependencies. Error: {e}", file=sys.stderr)
-        print(f"Please install the dependencies manually by opening up Protontricks,"
-              f"selecting \"Breath of the Wild Multiplayer\", then installing dotnetdesktop6.", file=sys.stderr)
-        print(f"Once you have done this, please press enter.", file=sys.stderr, end="")
-        input()
+        raise ManualStepRequired(
+            f"Failed to install dependencies. Error: {e}\n"
+            f"Please install the dependencies manually by opening up Protontricks, selecting \"Breath of the Wild "
+            f"Multiplayer\", then installing dotnetdesktop6.")
 
     expected_files = [dotnet_32_path, dotnet_64_path]
     for file in expected_files:
@@ -171,7 +188,7 @@ def add_dependencies_to_prefix(prefix_app_id: int):
     print("Dependencies installed successfully!")
 
 
-def set_proton_version(prefix_app_id: int):
+def set_proton_version(prefix_app_ids: List[int]):
     config_vdf_path = os.path.join(STEAM_DIR, "config", "config.vdf")
     if not os.path.exists(config_vdf_path):
         print("Steam config file not found! Exiting...", file=sys.stderr)
@@ -182,27 +199,69 @@ def set_proton_version(prefix_app_id: int):
     with open(config_vdf_path, "r") as config_file:
         data = vdf.load(config_file)
 
-    data["InstallConfigStore"]["Software"]["Valve"]["Steam"]["CompatToolMapping"][str(prefix_app_id)] = \
-        {
-            "name": "proton_experimental",
-            "config": "",
-            "priority": "250"
-        }
+    for prefix_app_id in prefix_app_ids:
+        data["InstallConfigStore"]["Software"]["Valve"]["Steam"]["CompatToolMapping"][str(prefix_app_id)] = \
+            {
+                "name": "proton_experimental",
+                "config": "",
+                "priority": "250"
+            }
 
     with open(config_vdf_path, "w") as config_file:
         vdf.dump(data, config_file)
 
 
-def generate_steam_shortcut() -> Tuple[int, int]:
+def find_shortcut(shortcuts: dict) -> Optional[dict]:
+    """
+    Find the mod's shortcut in the parsed contents of a shortcuts.vdf.
+    :param shortcuts: parsed shortcuts.vdf
+    :return: the shortcut's entry, or None if there is no shortcut for the mod
+    """
+    for shortcut in shortcuts.get("shortcuts", {}).values():
+        if ("appname" in shortcut and shortcut["appname"] == SHORTCUT_NAME) \
+                or ("AppName" in shortcut and shortcut["AppName"] == SHORTCUT_NAME):
+            return shortcut
+    return None
+
+
+def find_shortcut_app_id(shortcuts: dict) -> Optional[int]:
+    """
+    Find the mod's shortcut in the parsed contents of a shortcuts.vdf.
+    :param shortcuts: parsed shortcuts.vdf
+    :return: the shortcut's (shortcuts.vdf) app id, or None if there is no shortcut for the mod
+    """
+    shortcut = find_shortcut(shortcuts)
+    return shortcut.get("appid") if shortcut is not None else None
+
+
+def get_shortcut_app_id(user_id) -> Optional[int]:
+    """
+    Look up the mod's shortcut in the given Steam user's shortcuts.vdf.
+    :return: the shortcut's (shortcuts.vdf) app id, or None if the user has no shortcut for the mod
+    """
+    shortcuts_path = os.path.join(STEAM_DIR, f"userdata/{user_id}/config/shortcuts.vdf")
+    if not os.path.exists(shortcuts_path):
+        return None
+    with open(shortcuts_path, "rb") as shortcuts_file:
+        return find_shortcut_app_id(vdf.binary_load(shortcuts_file))
+
+
+def confirm_steam_close():
+    if is_unattended():
+        print("Steam will be closed for the following steps.")
+        return
     input(
         f"Steam will be closed for the following steps.\nIf this is okay, press enter to continue:")
 
-    terminate_program("steam", "Steam")
 
+def get_steam_users() -> Tuple[List[str], Dict[str, str]]:
+    """
+    Get the Steam users on this device.
+    :return: Tuple (user_ids, user_names), where user_names maps user ids to persona names where they are known
+    """
     # Get the existing user ids
     user_data_folder = os.path.join(STEAM_DIR, "userdata")
     user_ids = os.listdir(user_data_folder)
-    shortcut_name = "Breath of the Wild Multiplayer"
     user_names = {}
 
     # get user name from user id
@@ -229,19 +288,62 @@ def generate_steam_shortcut() -> Tuple[int, int]:
                 continue
             if friend_uid in friends_dict.keys() and "name" in friends_dict[friend_uid].keys():
                 user_names[friend_uid] = friends_dict[friend_uid]["name"]
-            
+
+    return user_ids, user_names
+
+
+def select_steam_users() -> List[str]:
+    """
+    Prompt the user to pick the Steam user(s) to add the shortcut for (or take them from the answers).
+    The answer may be a user id, a persona name, a list of either, or "all".
+    :return: the selected user ids
+    """
+    user_ids, user_names = get_steam_users()
+
+    answer = get_answer("steam_user")
+    if answer is not None:
+        if answer == "all":
+            return user_ids
+        selected = []
+        for user in (answer if isinstance(answer, list) else [answer]):
+            matches = [user_id for user_id in user_ids if str(user) in (user_id, user_names.get(user_id))]
+            if len(matches) == 0:
+                print(f"Steam user '{user}' not found! Users: {user_ids}", file=sys.stderr)
+                exit(EXIT_INVALID_ANSWER)
+            selected.append(matches[0])
+        return selected
+    if is_unattended():
+        if len(user_ids) == 1:
+            return user_ids
+        exit_answer_required("Enter the number of the user you want to use: ")
+
     # Prompt user to pick the user id
     print("Users:")
+    all_users_index = len(user_ids) if len(user_ids) > 1 else None
     selected_index = None
-    while selected_index not in range(len(user_ids)):
+    while selected_index not in range(len(user_ids)) and selected_index != all_users_index:
         for i, user_id in enumerate(user_ids):
             print(f"{i + 1}. {user_names[user_id] if user_id in user_names.keys() else '?'} ({user_id})")
+        if all_users_index is not None:
+            print(f"{all_users_index + 1}. All users")
 
         selected_index = int(input("Enter the number of the user you want to use: ")) - 1
-    user_id = user_ids[selected_index]
+    if selected_index == all_users_index:
+        return user_ids
+    return [user_ids[selected_index]]
+
+
+def add_shortcut_for_user(user_id: str) -> int:
+    """
+    Add the mod's shortcut to the given Steam user's shortcuts.vdf, if it isn't there already.
+    :param user_id: the Steam user to add the shortcut for
+    :return: the shortcut's prefix app id
+    """
+    shortcut_name = SHORTCUT_NAME
 
     shortcuts_path = os.path.join(STEAM_DIR, f"userdata/{user_id}/config/shortcuts.vdf")
     if not os.path.exists(shortcuts_path):
+        os.makedirs(os.path.dirname(shortcuts_path), exist_ok=True)
         with open(shortcuts_path, "wb") as shortcuts_file:
             vdf.binary_dump({"shortcuts": {}}, shortcuts_file)
 
@@ -253,13 +355,15 @@ def generate_steam_shortcut() -> Tuple[int, int]:
                                                  f"userdata/{user_id}/config/shortcuts.vdf.{int(time.time())}.bak"))
 
     # Check to see if there is an entry with the name "Breath of the Wild Multiplayer Mod"
-    shortcut_app_id = None
-    for shortcut in shortcuts.get("shortcuts", {}).values():
-        if ("appname" in shortcut and shortcut["appname"] == shortcut_name) \
-                or ("AppName" in shortcut and shortcut["AppName"] == shortcut_name):
-            if "appid" in shortcut:
-                shortcut_app_id = shortcut["appid"]
-            break
+    shortcut = find_shortcut(shortcuts)
+    shortcut_app_id = shortcut.get("appid") if shortcut is not None else None
+
+    # Existing shortcuts are switched over to the launch wrapper, keeping the user's own launch options
+    launch_options = shortcut.get("LaunchOptions", "") if shortcut is not None else ""
+    if shortcut_app_id and add_launcher_to_options(launch_options) != launch_options:
+        shortcut["LaunchOptions"] = add_launcher_to_options(launch_options)
+        with open(shortcuts_path, "wb") as shortcuts_file:
+            vdf.binary_dump(shortcuts, shortcuts_file)
 
     # If not, generate a shortcut with the name "Breath of the Wild Multiplayer Mod"
     if not shortcut_app_id:
@@ -277,7 +381,7 @@ def generate_steam_shortcut() -> Tuple[int, int]:
                 "Exe": new_shortcut.exe,
                 "StartDir": new_shortcut.startdir,
                 "icon": new_shortcut.icon,
-                "LaunchOptions": "",
+                "LaunchOptions": get_launch_options(),
                 "IsHidden": 0,
                 "AllowDesktopConfig": 1,
                 "AllowOverlay": 1,
@@ -295,16 +399,52 @@ def generate_steam_shortcut() -> Tuple[int, int]:
 
     prefix_app_id = appids.shortcut_id_to_short_app_id(shortcut_app_id)
     long_app_id = appids.lengthen_app_id(prefix_app_id)
-    # either way, set the proton version
-    set_proton_version(prefix_app_id)
 
-    # TODO maybe add this to log file once we do that
+    log_event("shortcut", user_id=user_id, shortcut_name=shortcut_name, shortcut_app_id=shortcut_app_id,
+              prefix_app_id=prefix_app_id, long_app_id=long_app_id)
+    print(f"Steam user: {user_id}")
     print(f"Shortcut name: {shortcut_name}")
     print(f"Shortcut app id: {shortcut_app_id}")
     print(f"Prefix app id: {prefix_app_id}")
     print(f"Long app id: {long_app_id}")
 
-    return int(prefix_app_id), int(user_id)
+    return int(prefix_app_id)
+
+
+def generate_steam_shortcut(user_ids: List[str]) -> Dict[str, int]:
+    """
+    Add the mod's shortcut to each given Steam user's shortcuts.vdf and set the Proton version of the shortcut(s) in
+    a single pass over config.vdf. Closes Steam.
+    :param user_ids: the Steam users to add the shortcut for, as returned by select_steam_users()
+    :return: dict of user id to the prefix app id of that user's shortcut (normally the same for every user)
+    """
+    terminate_program("steam", "Steam")
+
+    prefix_app_ids = {user_id: add_shortcut_for_user(user_id) for user_id in user_ids}
+
+    # either way, set the proton version
+    set_proton_version(sorted(set(prefix_app_ids.values())))
+
+    return prefix_app_ids
+
+
+def get_grid_files() -> List[str]:
+    """
+    Get the names of the artwork files in GRIDS_DIR (none if it is missing).
+    """
+    try:
+        return os.listdir(GRIDS_DIR)
+    except FileNotFoundError:
+        return []
+
+
+def has_grids(app_id: int, user_id: int) -> bool:
+    """
+    Check whether the artwork from GRIDS_DIR is in place for the given shortcut and Steam user.
+    """
+    grid_dir = os.path.join(STEAM_DIR, f"userdata/{user_id}/config/grid")
+    return all(os.path.exists(os.path.join(grid_dir, file.replace('BotWM', str(app_id))))
+               for file in get_grid_files())
 
 
 def add_grids(app_id: int, user_id: int):
@@ -312,13 +452,13 @@ def add_grids(app_id: int, user_id: int):
     if not os.path.exists(grid_dir):
         os.makedirs(grid_dir)
     try:
-        for file in os.listdir("./grids"):
-            shutil.copy(f"./grids/{file}",
+        for file in os.listdir(GRIDS_DIR):
+            shutil.copy(os.path.join(GRIDS_DIR, file),
                         os.path.join(STEAM_DIR, f"userdata/{user_id}/config/grid/{file.replace('BotWM', str(app_id))}"))
     except FileNotFoundError:
         print(f"Could not write to your Steam artwork folder. If you want custom artwork for your shortcut, please "
-              f"add the files from {os.path.abspath('./grids/')} manually in the Steam desktop client.")
+              f"add the files from {GRIDS_DIR} manually in the Steam desktop client.")
     except Exception as e:
         print(f"An error has occurred while adding artwork to Steam. Please continue with installation, and add the "
               f"artwork to Steam later if desired.\n"
-              f"All artwork can be found in {os.path.abspath('./grids/')}\nError: {e}")
+              f"All artwork can be found in {GRIDS_DIR}\nError: {e}")
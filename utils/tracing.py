@@ -0,0 +1,229 @@
+"""
+Functions for tracing where an install run spends its time.
+
+Each traced span (an install stage, or a heavy call inside one) is written as one JSON line to a per-run log under
+WORKING_DIR/logs, with its wall time, CPU time, peak RSS, disk bytes read/written and network bytes, and the id of
+the span it was started in on the same thread (its parent, e.g. the stage a BCML call ran in). CPU time is
+measured for the calling thread plus any subprocesses that finished during the span; the other counters are
+process-wide (or, for the network, per network namespace), so spans that overlap with concurrently running stages
+include each other's activity.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.common import WORKING_DIR
+from utils.priority import get_throttle_stats
+
+LOG_DIR = os.path.join(WORKING_DIR, "logs")
+
+_run: Optional[Dict[str, Any]] = None
+_lock = threading.Lock()
+_profile_lock = threading.Lock()  # only one profiler can be active at a time (Python 3.12+ raises otherwise)
+_span_ids = itertools.count(1)
+_local = threading.local()  # id of the span the current thread is in, the parent of any span it starts
+
+
+def read_proc_io() -> Dict[str, int]:
+    """
+    Read the bytes this process has read from and written to storage, from /proc/self/io.
+    """
+    counters = {"read_bytes": 0, "write_bytes": 0}
+    try:
+        with open("/proc/self/io", "r") as io_file:
+            for line in io_file:
+                key, value = line.split(":")
+                if key in counters:
+                    counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def read_net_bytes() -> Dict[str, int]:
+    """
+    Read the bytes received and sent on all non-loopback interfaces, from /proc/self/net/dev.
+    """
+    counters = {"rx_bytes": 0, "tx_bytes": 0}
+    try:
+        with open("/proc/self/net/dev", "r") as net_file:
+            for line in net_file.readlines()[2:]:
+                interface, data = line.split(":", 1)
+                if interface.strip() == "lo":
+                    continue
+                fields = data.split()
+                counters["rx_bytes"] += int(fields[0])
+                counters["tx_bytes"] += int(fields[8])
+    except (OSError, ValueError, IndexError):
+        pass
+    return counters
+
+
+def take_sample() -> Dict[str, float]:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sample = {
+        "wall": time.perf_counter(),
+        "cpu": time.thread_time() + children.ru_utime + children.ru_stime,
+    }
+    sample.update(read_proc_io())
+    sample.update(read_net_bytes())
+    throttle = get_throttle_stats()
+    sample["throttle_wait_s"] = throttle["wait_s"]
+    sample["throttled_bytes"] = throttle["bytes"]
+    return sample
+
+
+def start_run(profile: bool = False) -> str:
+    """
+    Start tracing a run. Spans are only recorded between start_run() and end_run().
+    :param profile: also dump a cProfile profile of every stage (the stages should then be run one at a time)
+    :return: path of the run log
+    """
+    global _run
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    os.makedirs(LOG_DIR, exist_ok=True)
+    _run = {"id": run_id, "path": os.path.join(LOG_DIR, f"run-{run_id}.jsonl"), "profile": profile, "spans": []}
+    log_event("run_start", argv=sys.argv[1:])
+    return _run["path"]
+
+
+def end_run() -> Optional[Dict[str, Any]]:
+    """
+    Stop tracing the run.
+    :return: the run (including the list of recorded spans), or None if no run was being traced
+    """
+    global _run
+    if _run is None:
+        return None
+    log_event("run_end")
+    run, _run = _run, None
+    return run
+
+
+def log_event(event: str, **data):
+    """
+    Write a record to the run log (does nothing if no run is being traced).
+    """
+    if _run is None:
+        return
+    record = {"event": event, "run": _run["id"], "time": time.time(), "thread": threading.current_thread().name}
+    record.update(data)
+    with _lock:
+        with open(_run["path"], "a") as log_file:
+            log_file.write(json.dumps(record, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def span(name: str, stage: bool = False):
+    """
+    Trace a block of code.
+    :param name: name of the span, e.g. the stage name or "install_mod"
+    :param stage: whether the span is a whole install stage (stages are profiled if profiling is on, unless another
+    stage is already being profiled)
+    """
+    if _run is None:
+        yield
+        return
+
+    profiler = None
+    if stage and _run["profile"] and _profile_lock.acquire(blocking=False):
+        import cProfile
+        profiler = cProfile.Profile()
+    span_id = next(_span_ids)
+    parent_id = getattr(_local, "span_id", None)
+    _local.span_id = span_id
+    start_time = time.time()
+    start = take_sample()
+    if profiler is not None:
+        profiler.enable()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _local.span_id = parent_id
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+        end = take_sample()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record = {
+            "id": span_id,
+            "parent": parent_id,
+            "name": name,
+            "stage": stage,
+            "start_time": start_time,
+            "wall_s": round(end["wall"] - start["wall"], 4),
+            "cpu_s": round(end["cpu"] - start["cpu"], 4),
+            "peak_rss_kb": usage.ru_maxrss,
+            "children_peak_rss_kb": children.ru_maxrss,
+            "read_bytes": end["read_bytes"] - start["read_bytes"],
+            "write_bytes": end["write_bytes"] - start["write_bytes"],
+            "net_rx_bytes": end["rx_bytes"] - start["rx_bytes"],
+            "net_tx_bytes": end["tx_bytes"] - start["tx_bytes"],
+            "throttle_wait_s": round(end["throttle_wait_s"] - start["throttle_wait_s"], 4),
+            "throttled_bytes": end["throttled_bytes"] - start["throttled_bytes"],
+            "error": error,
+        }
+        if profiler is not None:
+            profile_dir = os.path.join(LOG_DIR, f"profiles-{_run['id']}")
+            os.makedirs(profile_dir, exist_ok=True)
+            record["profile"] = os.path.join(profile_dir, f"{name}.prof")
+            profiler.dump_stats(record["profile"])
+        with _lock:
+            _run["spans"].append(record)
+        log_event("span", **record)
+
+
+def traced(name: str, func, stage: bool = False):
+    """
+    Wrap a function so every call is traced as a span.
+    """
+    def wrapper(*args, **kwargs):
+        with span(name, stage):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def print_report(run: Dict[str, Any]):
+    """
+    Print a summary of the spans recorded in a run.
+    """
+    def mb(num_bytes: int) -> str:
+        return f"{num_bytes / 1024 / 1024:9.1f}"
+
+    if not run["spans"]:
+        return
+    # stages run concurrently, so their spans interleave in time: list each span under the span it ran in
+    span_ids = {record["id"] for record in run["spans"]}
+    children: Dict[Optional[int], List[Dict[str, Any]]] = {}
+    for record in sorted(run["spans"], key=lambda r: r["start_time"]):
+        parent_id = record["parent"] if record["parent"] in span_ids else None
+        children.setdefault(parent_id, []).append(record)
+
+    def print_spans(parent_id: Optional[int], depth: int):
+        for record in children.get(parent_id, []):
+            name = "  " * depth + record["name"]
+            print(f"{name:<22}{record['wall_s']:9.1f}{record['cpu_s']:9.1f}{mb(record['read_bytes'])}"
+                  f"{mb(record['write_bytes'])}{mb(record['net_rx_bytes'] + record['net_tx_bytes'])}"
+                  f"{record.get('throttle_wait_s', 0):11.1f}")
+            print_spans(record["id"], depth + 1)
+
+    print(f"\n{'span':<22}{'wall s':>9}{'cpu s':>9}{'read MB':>9}{'write MB':>9}{'net MB':>9}{'throttle s':>11}")
+    print_spans(None, 0)
+    peak_rss = max((record["peak_rss_kb"] for record in run["spans"]), default=0)
+    print(f"Peak RSS: {peak_rss / 1024:.0f} MB. Full run log: {run['path']}")
+    throttle = get_throttle_stats()
+    if throttle["bytes"] > 0:
+        print(f"Rate-limited copies: {throttle['bytes'] / 1024 / 1024:.1f} MB, {throttle['wait_s']:.1f} s spent "
+              f"waiting for the rate limit.")
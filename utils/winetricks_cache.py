@@ -0,0 +1,153 @@
+"""
+Functions for managing the installer's own cache of winetricks downloads (e.g. the .NET desktop runtime).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from utils.common import WORKING_DIR
+
+CACHE_DIR = os.path.join(WORKING_DIR, "winetricks_cache")
+MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+DOTNET_VERB = "dotnetdesktop6"
+
+PROTONTRICKS_FLATPAK = "com.github.Matoking.protontricks"
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Compute the SHA-256 hash of a file.
+    :param file_path: file to hash
+    :return: hex digest of the file's contents
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def load_manifest() -> Dict[str, Dict]:
+    """
+    Load the cache manifest, which maps "<verb>/<file name>" to the file's size and SHA-256 hash.
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        print("Winetricks cache manifest is unreadable, re-verifying the cache from scratch.", file=sys.stderr)
+        return {}
+
+
+def save_manifest(manifest: Dict[str, Dict]):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _cached_files() -> List[str]:
+    """
+    List all payloads in the cache as "<verb>/<file name>".
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for verb in os.listdir(CACHE_DIR):
+        verb_dir = os.path.join(CACHE_DIR, verb)
+        if not os.path.isdir(verb_dir):
+            continue
+        for file in os.listdir(verb_dir):
+            if not file.endswith(".tmp") and os.path.isfile(os.path.join(verb_dir, file)):
+                entries.append(f"{verb}/{file}")
+    return entries
+
+
+def verify_cache() -> List[str]:
+    """
+    Check every payload recorded in the manifest against its hash, and remove any that are missing or corrupted so
+    winetricks downloads them again.
+    :return: list of the removed entries
+    """
+    manifest = load_manifest()
+    removed = []
+    for entry, info in list(manifest.items()):
+        file_path = os.path.join(CACHE_DIR, entry)
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == info["size"] \
+                and hash_file(file_path) == info["sha256"]:
+            continue
+        print(f"Cached file {entry} is missing or corrupted, removing it from the cache.", file=sys.stderr)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        del manifest[entry]
+        removed.append(entry)
+    if removed:
+        save_manifest(manifest)
+    return removed
+
+
+def record_cache() -> List[str]:
+    """
+    Add payloads that winetricks downloaded into the cache to the manifest. Winetricks has already checked these
+    against its own hashes at download time, so they are trusted from here on.
+    :return: list of the newly recorded entries
+    """
+    manifest = load_manifest()
+    recorded = []
+    for entry in _cached_files():
+        if entry in manifest:
+            continue
+        file_path = os.path.join(CACHE_DIR, entry)
+        manifest[entry] = {"size": os.path.getsize(file_path), "sha256": hash_file(file_path)}
+        recorded.append(entry)
+    if recorded:
+        save_manifest(manifest)
+    return recorded
+
+
+def add_to_cache(file_path: str, verb: str = DOTNET_VERB, sha256: Optional[str] = None) -> str:
+    """
+    Copy a local installer payload into the cache so that winetricks never has to download it.
+    :param file_path: path to the payload, e.g. windowsdesktop-runtime-6.0.x-win-x64.exe
+    :param verb: the winetricks verb the payload belongs to
+    :param sha256: expected SHA-256 hash of the payload (optional)
+    :return: the "<verb>/<file name>" entry the payload was stored as
+    """
+    digest = hash_file(file_path)
+    if sha256 is not None and digest != sha256.lower():
+        raise ValueError(f"Hash mismatch for {file_path}: expected {sha256}, got {digest}")
+
+    entry = f"{verb}/{os.path.basename(file_path)}"
+    destination = os.path.join(CACHE_DIR, entry)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # copy to a temporary file first so a half-written payload is never picked up by winetricks
+    shutil.copyfile(file_path, destination + ".tmp")
+    os.replace(destination + ".tmp", destination)
+
+    manifest = load_manifest()
+    manifest[entry] = {"size": os.path.getsize(destination), "sha256": digest}
+    save_manifest(manifest)
+    return entry
+
+
+def get_cached_protontricks_cmd(protontricks_cmd: str) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Build the Protontricks command and environment needed for winetricks to use the installer's cache.
+    :param protontricks_cmd: Command needed to run Protontricks, as returned by install_protontricks()
+    :return: Tuple (cmd, env) to pass to subprocess.run
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cmd = protontricks_cmd.split()
+    env = dict(os.environ, W_CACHE=CACHE_DIR)
+    if PROTONTRICKS_FLATPAK in cmd:
+        # the flatpak sandbox doesn't inherit our environment or see our working dir, so pass both through
+        index = cmd.index(PROTONTRICKS_FLATPAK)
+        cmd[index:index] = [f"--env=W_CACHE={CACHE_DIR}", f"--filesystem={CACHE_DIR}"]
+    return cmd, env